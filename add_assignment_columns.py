@@ -0,0 +1,109 @@
+"""
+Add assignment-related columns to existing tables
+Run this once after upgrading; db.create_all() only creates missing tables,
+it never adds columns to tables that already exist.
+"""
+from app import create_app, db
+from sqlalchemy import text, inspect
+
+# (table, column, column definition)
+COLUMNS = [
+    ('events', 'chain_length', 'INT NULL'),
+    ('events', 'gifts_per_giver', 'INT DEFAULT 1'),
+    ('events', 'mix_groups', 'BOOLEAN DEFAULT FALSE'),
+    ('assignments', 'slot', 'INT NOT NULL DEFAULT 0'),
+    ('participants', 'group_key', 'VARCHAR(100) NULL'),
+    ('assignment_jobs', 'updated_at', 'DATETIME NULL'),
+    ('assignment_jobs', 'seed', 'BIGINT NULL'),
+    ('assignment_jobs', 'fingerprint', 'CHAR(64) NULL'),
+]
+
+# (table, constraint name, columns) to add if missing
+UNIQUE_CONSTRAINTS = [
+    ('assignments', 'unique_giver_slot', 'event_id, giver_id, slot'),
+    ('assignments', 'unique_receiver_slot', 'event_id, receiver_id, slot'),
+    ('assignments', 'unique_pair', 'event_id, giver_id, receiver_id'),
+]
+
+# (table, index name, columns) to add if missing
+INDEXES = [
+    ('events', 'ix_events_gift_deadline', 'gift_deadline'),  # Deadline reminder range scans
+    ('events', 'idx_events_created', 'created_at, event_id'),  # list_events keyset pages
+]
+
+# (table, constraint name) replaced by the ones above
+OLD_UNIQUE_CONSTRAINTS = [
+    ('assignments', 'unique_giver'),
+]
+
+def _drop_unique(table, name):
+    """DROP a unique key; MySQL calls it an index, others a constraint"""
+    if db.engine.dialect.name == 'mysql':
+        return text(f"ALTER TABLE {table} DROP INDEX {name}")
+    return text(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+
+def add_assignment_columns():
+    """Add any missing assignment columns"""
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            print("=" * 60)
+            print("ADDING ASSIGNMENT COLUMNS")
+            print("=" * 60)
+            
+            inspector = inspect(db.engine)
+            added = 0
+            
+            for table, column, definition in COLUMNS:
+                existing = {c['name'] for c in inspector.get_columns(table)}
+                if column in existing:
+                    print(f"✓ {table}.{column} already exists")
+                    continue
+                
+                db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                print(f"✓ Added {table}.{column}")
+                added += 1
+            
+            # New keys go in before the old one is dropped, so the foreign key
+            # on event_id always has an index to use
+            for table, name, columns in UNIQUE_CONSTRAINTS:
+                existing = {c['name'] for c in inspector.get_unique_constraints(table)}
+                if name in existing:
+                    print(f"✓ {table}.{name} already exists")
+                    continue
+                
+                db.session.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE ({columns})"))
+                print(f"✓ Added {table}.{name}")
+                added += 1
+            
+            for table, name, columns in INDEXES:
+                existing = {i['name'] for i in inspector.get_indexes(table)}
+                if name in existing:
+                    print(f"✓ {table}.{name} already exists")
+                    continue
+                
+                db.session.execute(text(f"CREATE INDEX {name} ON {table} ({columns})"))
+                print(f"✓ Added {table}.{name}")
+                added += 1
+            
+            for table, name in OLD_UNIQUE_CONSTRAINTS:
+                existing = {c['name'] for c in inspector.get_unique_constraints(table)}
+                if name not in existing:
+                    continue
+                
+                db.session.execute(_drop_unique(table, name))
+                print(f"✓ Dropped {table}.{name}")
+            
+            db.session.commit()
+            print("=" * 60)
+            print(f"Done: {added} column(s), key(s) and index(es) added")
+            print("=" * 60)
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"✗ Error: {e}")
+            print("\nCheck the database connection and try again.")
+
+if __name__ == '__main__':
+    add_assignment_columns()
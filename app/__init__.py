@@ -20,6 +20,7 @@ def create_app(config_name='development'):
     """Application factory function"""
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    app.config['CONFIG_NAME'] = config_name  # Lets worker processes rebuild the same app
     
     # Initialize extensions with app
     db.init_app(app)
@@ -58,6 +59,12 @@ def create_app(config_name='development'):
             from flask import redirect, url_for
             return redirect(url_for('auth.login'))
     
+    # CLI: flask drain-outbox, flask send-reminders
+    from app.utils.outbox import drain_outbox_command
+    from app.utils.reminders import send_reminders_command
+    app.cli.add_command(drain_outbox_command)
+    app.cli.add_command(send_reminders_command)
+    
     # Create database tables
     with app.app_context():
         db.create_all()
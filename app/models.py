@@ -53,10 +53,13 @@ class Event(db.Model):
     invite_code = db.Column(db.String(20), unique=True, nullable=False, index=True)
     status = db.Column(db.String(20), default='pending')  # pending, active, completed, cancelled
     assignment_done = db.Column(db.Boolean, default=False)
+    chain_length = db.Column(db.Integer)  # Longest gift chain; equals participant count for a single ring
+    gifts_per_giver = db.Column(db.Integer, default=1)  # Each participant gives (and receives) this many gifts
+    mix_groups = db.Column(db.Boolean, default=False)  # Sharded mode: also pair some people across groups
     privacy_type = db.Column(db.String(20), default='public')  # public, private
     visibility = db.Column(db.String(20), default='all')  # all, participants_only, invite_only
     allow_public_join = db.Column(db.Boolean, default=True)  # Can anyone with invite code join?
-    gift_deadline = db.Column(db.DateTime)
+    gift_deadline = db.Column(db.DateTime, index=True)  # Reminder ticks range-scan this
     event_date = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -64,11 +67,28 @@ class Event(db.Model):
     # Relationships
     participants = db.relationship('Participant', backref='event', lazy='dynamic', cascade='all, delete-orphan')
     assignments = db.relationship('Assignment', backref='event', lazy='dynamic', cascade='all, delete-orphan')
+    assignment_set = db.relationship('AssignmentSet', backref='event', uselist=False, cascade='all, delete-orphan')
     messages = db.relationship('Message', backref='event', lazy='dynamic', cascade='all, delete-orphan')
+    exclusion_rules = db.relationship('ExclusionRule', backref='event', lazy='dynamic', cascade='all, delete-orphan')
+    assignment_jobs = db.relationship('AssignmentJob', backref='event', lazy='dynamic', cascade='all, delete-orphan')
+    reminder_logs = db.relationship('ReminderLog', backref='event', lazy='dynamic', cascade='all, delete-orphan')
+    
+    # list_events pages newest first by (created_at, event_id)
+    __table_args__ = (db.Index('idx_events_created', 'created_at', 'event_id'),)
     
     def __repr__(self):
         return f'<Event {self.event_name}>'
 
+class InviteCodeBlock(db.Model):
+    """Block of invite code sequence numbers reserved by one process (see utils.invite_codes)"""
+    __tablename__ = 'invite_code_blocks'
+    
+    block_id = db.Column(db.Integer, primary_key=True)  # Covers block_id * BLOCK_SIZE onwards
+    reserved_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<InviteCodeBlock {self.block_id}>'
+
 class Participant(db.Model):
     """Participant model"""
     __tablename__ = 'participants'
@@ -79,6 +99,7 @@ class Participant(db.Model):
     wishlist_id = db.Column(db.Integer, db.ForeignKey('wishlists.wishlist_id'), nullable=True)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(20), default='active')  # active, dropped, completed
+    group_key = db.Column(db.String(100))  # Department / office; sharded assignment pairs within it
     
     # Relationships
     wishlist = db.relationship('Wishlist', backref='participant', uselist=False)
@@ -118,15 +139,93 @@ class Assignment(db.Model):
     event_id = db.Column(db.Integer, db.ForeignKey('events.event_id'), nullable=False)
     giver_id = db.Column(db.Integer, db.ForeignKey('participants.participant_id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('participants.participant_id'), nullable=False)
+    slot = db.Column(db.Integer, nullable=False, default=0)  # 0 .. gifts_per_giver - 1
     compatibility_score = db.Column(db.Float, default=0.0)
     assigned_at = db.Column(db.DateTime, default=datetime.utcnow)
     gift_status = db.Column(db.String(20), default='pending')  # pending, purchased, delivered
     
-    __table_args__ = (db.UniqueConstraint('event_id', 'giver_id', name='unique_giver'),)
+    # One receiver per giver per slot and one giver per receiver per slot;
+    # also the indexes behind every giver and receiver lookup
+    __table_args__ = (
+        db.UniqueConstraint('event_id', 'giver_id', 'slot', name='unique_giver_slot'),
+        db.UniqueConstraint('event_id', 'receiver_id', 'slot', name='unique_receiver_slot'),
+        db.UniqueConstraint('event_id', 'giver_id', 'receiver_id', name='unique_pair'),
+    )
     
     def __repr__(self):
         return f'<Assignment {self.assignment_id}>'
 
+class AssignmentSet(db.Model):
+    """Packed assignments of one large event (see utils/assignment_store.py)"""
+    __tablename__ = 'assignment_sets'
+    
+    event_id = db.Column(db.Integer, db.ForeignKey('events.event_id'), primary_key=True)
+    base_id = db.Column(db.Integer, nullable=False)  # Lowest participant_id covered
+    span = db.Column(db.Integer, nullable=False)  # Entries per slot: highest participant_id - base_id + 1
+    slots = db.Column(db.Integer, nullable=False, default=1)
+    pair_count = db.Column(db.Integer, nullable=False, default=0)
+    # int32 per (slot, participant), 0 = none; givers is the inverse of receivers
+    receivers = db.Column(db.LargeBinary(length=2**32 - 1), nullable=False)
+    givers = db.Column(db.LargeBinary(length=2**32 - 1), nullable=False)
+    scores = db.Column(db.LargeBinary(length=2**32 - 1), nullable=False)  # uint16 per (slot, giver), score * 65535
+    assigned_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AssignmentSet {self.event_id}>'
+
+class ExclusionRule(db.Model):
+    """Pairing exclusion rule model (couples, households, managers)"""
+    __tablename__ = 'exclusion_rules'
+    
+    rule_id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('events.event_id'), nullable=False, index=True)
+    giver_id = db.Column(db.Integer, db.ForeignKey('participants.participant_id'), nullable=False)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('participants.participant_id'), nullable=False)
+    rule_type = db.Column(db.String(20), default='custom')  # couple, household, manager, custom
+    bidirectional = db.Column(db.Boolean, default=True)  # Also block receiver -> giver
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('event_id', 'giver_id', 'receiver_id', name='unique_exclusion'),)
+    
+    def __repr__(self):
+        return f'<ExclusionRule {self.giver_id}->{self.receiver_id}>'
+
+class AssignmentJob(db.Model):
+    """Background assignment job model"""
+    __tablename__ = 'assignment_jobs'
+    
+    job_id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('events.event_id'), nullable=False, index=True)
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
+    mode = db.Column(db.String(20), default='random')
+    replace = db.Column(db.Boolean, default=False)  # Reshuffle instead of first assignment
+    seed = db.Column(db.BigInteger)  # Previewed candidate to reproduce, if any
+    fingerprint = db.Column(db.String(64))  # Inputs the preview was drawn from; a mismatch fails the job
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, failed
+    progress = db.Column(db.Integer, default=0)  # 0-100
+    message = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime)  # Last progress report; stale jobs are failed after ASSIGNMENT_JOB_TIMEOUT
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<AssignmentJob {self.job_id}>'
+
+class ReminderLog(db.Model):
+    """Deadline reminder already sent to a giver, so a restart never sends it again"""
+    __tablename__ = 'reminder_logs'
+    
+    reminder_id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('events.event_id'), nullable=False)
+    participant_id = db.Column(db.Integer, db.ForeignKey('participants.participant_id'), nullable=False)
+    window_hours = db.Column(db.Integer, nullable=False)  # Reminder window it was sent for (REMINDER_WINDOWS)
+    sent_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('event_id', 'participant_id', 'window_hours', name='unique_reminder'),)
+    
+    def __repr__(self):
+        return f'<ReminderLog {self.event_id}/{self.participant_id} {self.window_hours}h>'
+
 class Message(db.Model):
     """Anonymous message model"""
     __tablename__ = 'messages'
@@ -142,3 +241,30 @@ class Message(db.Model):
     
     def __repr__(self):
         return f'<Message {self.message_id}>'
+
+class EmailOutbox(db.Model):
+    """Outgoing email, written in the same transaction as the change it reports"""
+    __tablename__ = 'email_outbox'
+    
+    outbox_id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False, default='email')  # email, event_status (one row per participant once drained)
+    recipient = db.Column(db.String(120))
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text(length=2**24 - 1))
+    payload = db.Column(db.Text)  # JSON arguments of a fan-out row
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32))  # Claim token of the worker sending it
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('idx_outbox_due', 'status', 'next_attempt_at'),
+        db.Index('idx_outbox_claim', 'claimed_by'),
+    )
+    
+    def __repr__(self):
+        return f'<EmailOutbox {self.outbox_id} {self.status}>'
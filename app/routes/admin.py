@@ -1,11 +1,14 @@
 """
 Admin routes
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
 from app import db
-from app.models import Event, Participant, Assignment, User
-from app.utils.assignment_engine import SmartAssignmentEngine
+from app.models import Event, Participant, User, ExclusionRule, AssignmentJob
+from app.utils.assignment_engine import SmartAssignmentEngine, close_gap_for_participant
+from app.utils.assignment_jobs import start_assignment_job
+from app.utils.assignment_store import event_pairs
+from sqlalchemy import update
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -25,18 +28,25 @@ def event_dashboard(event_id):
         status='active'
     ).all()
     
-    assignments = Assignment.query.filter_by(event_id=event_id).all()
+    pairs = event_pairs(event_id)
+    expected = len(participants) * (event.gifts_per_giver or 1)
+    
+    # Receiver names per giver, from the participants already loaded
+    names = {p.participant_id: p.user.name for p in participants}
+    receivers_of = {}
+    for giver_id, receiver_id in pairs:
+        receivers_of.setdefault(giver_id, []).append(names.get(receiver_id, ''))
     
     stats = {
         'total_participants': len(participants),
-        'assignments_done': len(assignments),
-        'assignment_percentage': (len(assignments) / len(participants) * 100) if participants else 0
+        'assignments_done': len(pairs),
+        'assignment_percentage': (len(pairs) / expected * 100) if expected else 0
     }
     
     return render_template('admin/event_dashboard.html', 
                          event=event, 
                          participants=participants,
-                         assignments=assignments,
+                         receivers_of=receivers_of,
                          stats=stats)
 
 @admin_bp.route('/event/<int:event_id>/assign', methods=['POST'])
@@ -52,21 +62,32 @@ def trigger_assignment(event_id):
     if event.assignment_done:
         return jsonify({'success': False, 'message': 'Assignment already done'}), 400
     
-    participants = Participant.query.filter_by(
+    participant_count = Participant.query.filter_by(
         event_id=event_id,
         status='active'
-    ).all()
+    ).count()
     
-    if len(participants) < 2:
+    if participant_count < 2:
         return jsonify({'success': False, 'message': 'Need at least 2 participants'}), 400
     
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'random')
+    
+    error = _apply_assignment_options(event, data, participant_count)
+    if error:
+        return error
+    
+    if _run_in_background(data, participant_count):
+        return _start_job(event, mode, replace=False)
+    
     try:
         engine = SmartAssignmentEngine(event_id)
-        result = engine.generate_assignments()
+        result = engine.generate_assignments(mode=mode)
         
         if result['success']:
             event.assignment_done = True
             event.status = 'active'
+            _notify_givers(event)
             db.session.commit()
             return jsonify({'success': True, 'message': 'Assignments generated successfully!'})
         else:
@@ -85,15 +106,25 @@ def reshuffle_assignments(event_id):
     if event.admin_id != current_user.user_id and current_user.role != 'super_admin':
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
     
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'random')
+    
+    participant_count = Participant.query.filter_by(event_id=event_id, status='active').count()
+    
+    error = _apply_assignment_options(event, data, participant_count)
+    if error:
+        return error
+    
+    if _run_in_background(data, participant_count):
+        return _start_job(event, mode, replace=True)
+    
     try:
-        # Delete existing assignments
-        Assignment.query.filter_by(event_id=event_id).delete()
-        
-        # Generate new assignments
+        # Replace existing assignments in the same transaction
         engine = SmartAssignmentEngine(event_id)
-        result = engine.generate_assignments()
+        result = engine.generate_assignments(mode=mode, replace=True)
         
         if result['success']:
+            _notify_givers(event)
             db.session.commit()
             return jsonify({'success': True, 'message': 'Assignments reshuffled successfully!'})
         else:
@@ -103,3 +134,349 @@ def reshuffle_assignments(event_id):
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@admin_bp.route('/event/<int:event_id>/preview', methods=['POST'])
+@login_required
+def preview_assignments(event_id):
+    """Score several candidate draws without saving any of them"""
+    event = Event.query.get_or_404(event_id)
+    
+    if event.admin_id != current_user.user_id and current_user.role != 'super_admin':
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'random')
+    
+    participant_count = Participant.query.filter_by(event_id=event_id, status='active').count()
+    error = _apply_assignment_options(event, data, participant_count)
+    if error:
+        return error
+    
+    try:
+        engine = SmartAssignmentEngine(event_id)
+        result = engine.preview_assignments(
+            mode=mode,
+            replace=bool(event.assignment_done),
+            candidates=int(data.get('candidates') or current_app.config.get('ASSIGNMENT_PREVIEW_CANDIDATES', 8)),
+            top=int(data.get('top') or 3)
+        )
+        # Options only apply to this preview until a candidate is committed
+        db.session.rollback()
+        return jsonify(result), (200 if result['success'] else 400)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@admin_bp.route('/event/<int:event_id>/preview/commit', methods=['POST'])
+@login_required
+def commit_preview(event_id):
+    """Save a previewed candidate, reproduced from its seed"""
+    event = Event.query.get_or_404(event_id)
+    
+    if event.admin_id != current_user.user_id and current_user.role != 'super_admin':
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'random')
+    
+    try:
+        seed = int(data['seed'])
+        fingerprint = str(data['fingerprint'])
+        if not 0 <= seed < 2 ** 32 or len(fingerprint) != 64:
+            raise ValueError(seed)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'seed and fingerprint from a preview are required'}), 400
+    
+    participant_count = Participant.query.filter_by(event_id=event_id, status='active').count()
+    error = _apply_assignment_options(event, data, participant_count)
+    if error:
+        return error
+    
+    replace = bool(event.assignment_done)
+    if _run_in_background(data, participant_count):
+        return _start_job(event, mode, replace, seed=seed, fingerprint=fingerprint)
+    
+    try:
+        engine = SmartAssignmentEngine(event_id, seed=seed)
+        result = engine.generate_assignments(mode=mode, replace=replace, fingerprint=fingerprint)
+        
+        if not result['success']:
+            db.session.rollback()
+            return jsonify(result), (409 if result.get('stale') else 400)
+        
+        event.assignment_done = True
+        if not replace:
+            event.status = 'active'
+        _notify_givers(event)
+        db.session.commit()
+        return jsonify({'success': True, 'message': 'Assignments saved from preview!'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def _apply_assignment_options(event, data, participant_count):
+    """Take gifts_per_giver and mix_groups from the request; return an error response if invalid"""
+    # JSON true/false only: bool('false') would be True
+    if 'background' in data and not isinstance(data['background'], bool):
+        return jsonify({'success': False, 'message': 'background must be true or false'}), 400
+    
+    if 'mix_groups' in data:
+        event.mix_groups = bool(data['mix_groups'])
+    
+    if 'gifts_per_giver' not in data:
+        return None
+    
+    try:
+        gifts = int(data['gifts_per_giver'])
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Gifts per person must be a number'}), 400
+    
+    if gifts < 1 or gifts > SmartAssignmentEngine.MAX_GIFTS_PER_GIVER:
+        return jsonify({
+            'success': False,
+            'message': f'Gifts per person must be between 1 and {SmartAssignmentEngine.MAX_GIFTS_PER_GIVER}'
+        }), 400
+    
+    if gifts >= participant_count:
+        return jsonify({'success': False, 'message': f'{gifts} gifts per person needs at least {gifts + 1} participants'}), 400
+    
+    event.gifts_per_giver = gifts
+    return None
+
+def _run_in_background(data, participant_count):
+    """Large events (or an explicit request) go to a background job"""
+    if 'background' in data:
+        return data['background']
+    return participant_count >= current_app.config.get('ASSIGNMENT_ASYNC_THRESHOLD', 2000)
+
+def _start_job(event, mode, replace, seed=None, fingerprint=None):
+    """Queue an assignment job and answer with its id right away"""
+    job, running = start_assignment_job(
+        event.event_id,
+        current_user.user_id,
+        mode=mode,
+        replace=replace,
+        seed=seed,
+        fingerprint=fingerprint
+    )
+    if running:
+        return jsonify({
+            'success': False,
+            'message': 'An assignment job is already running for this event',
+            'job_id': running.job_id
+        }), 409
+    
+    if job.status == 'failed':
+        return jsonify({'success': False, 'message': job.message, 'job_id': job.job_id}), 503
+    
+    return jsonify({
+        'success': True,
+        'message': 'Assignment started in the background',
+        'job_id': job.job_id,
+        'status_url': url_for('admin.job_status', job_id=job.job_id)
+    }), 202
+
+def _notify_givers(event):
+    """Queue the assignment emails in the transaction that commits the assignments"""
+    try:
+        from app.utils.email_service import send_assignment_emails
+        send_assignment_emails(event)
+    except Exception as e:
+        print(f"Error sending assignment emails: {str(e)}")
+
+@admin_bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """Progress of a background assignment job"""
+    job = AssignmentJob.query.get_or_404(job_id)
+    event = Event.query.get_or_404(job.event_id)
+    
+    if event.admin_id != current_user.user_id and current_user.role != 'super_admin':
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.job_id,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message
+    })
+
+@admin_bp.route('/event/<int:event_id>/participant/<int:participant_id>/drop', methods=['POST'])
+@login_required
+def drop_participant(event_id, participant_id):
+    """Drop a participant and close the gap they leave in the assignments"""
+    event = Event.query.get_or_404(event_id)
+    
+    if event.admin_id != current_user.user_id and current_user.role != 'super_admin':
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    participant = Participant.query.filter_by(
+        event_id=event_id,
+        participant_id=participant_id
+    ).first_or_404()
+    
+    if participant.status != 'active':
+        return jsonify({'success': False, 'message': 'Participant is not active'}), 400
+    
+    try:
+        participant.status = 'dropped'
+        
+        if event.assignment_done:
+            result = close_gap_for_participant(event_id, participant_id)
+            if not result['success']:
+                db.session.rollback()
+                return jsonify(result), 400
+        
+        db.session.commit()
+        return jsonify({'success': True, 'message': 'Participant dropped'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@admin_bp.route('/event/<int:event_id>/groups', methods=['POST'])
+@login_required
+def set_participant_groups(event_id):
+    """Set group keys (department, office) for many participants at once"""
+    event = Event.query.get_or_404(event_id)
+    
+    if event.admin_id != current_user.user_id and current_user.role != 'super_admin':
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    groups = data.get('groups')
+    if not isinstance(groups, dict):
+        return jsonify({'success': False, 'message': 'groups must map participant ids to group names'}), 400
+    
+    wanted = {}
+    try:
+        for pid, group in groups.items():
+            group = str(group).strip()[:100] if group is not None else ''
+            wanted[int(pid)] = group or None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Participant ids must be numbers'}), 400
+    
+    known = {pid for (pid,) in db.session.query(Participant.participant_id).filter(
+        Participant.event_id == event_id,
+        Participant.participant_id.in_(list(wanted))
+    )}
+    
+    try:
+        # Bulk UPDATE by primary key, one executemany for the whole batch
+        if known:
+            db.session.execute(update(Participant), [
+                {'participant_id': pid, 'group_key': wanted[pid]}
+                for pid in known
+            ])
+        db.session.commit()
+        return jsonify({
+            'success': True,
+            'message': f'Groups set for {len(known)} participants',
+            'unknown': sorted(set(wanted) - known)
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@admin_bp.route('/event/<int:event_id>/exclusions', methods=['GET'])
+@login_required
+def list_exclusions(event_id):
+    """List exclusion rules for event"""
+    event = Event.query.get_or_404(event_id)
+    
+    if event.admin_id != current_user.user_id and current_user.role != 'super_admin':
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    rules = ExclusionRule.query.filter_by(event_id=event_id).all()
+    return jsonify({
+        'success': True,
+        'rules': [{
+            'rule_id': r.rule_id,
+            'giver_id': r.giver_id,
+            'receiver_id': r.receiver_id,
+            'rule_type': r.rule_type,
+            'bidirectional': r.bidirectional
+        } for r in rules]
+    })
+
+@admin_bp.route('/event/<int:event_id>/exclusions', methods=['POST'])
+@login_required
+def add_exclusions(event_id):
+    """
+    Add exclusion rules for a group of participants.
+    
+    With bidirectional (default) nobody in the group can draw anyone else in
+    it (couples, households, teams). Without it, only the first participant
+    is blocked from giving to the others (e.g. a manager and direct reports).
+    """
+    event = Event.query.get_or_404(event_id)
+    
+    if event.admin_id != current_user.user_id and current_user.role != 'super_admin':
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    data = request.get_json() or {}
+    participant_ids = list(dict.fromkeys(data.get('participant_ids') or []))
+    rule_type = data.get('rule_type', 'custom')
+    bidirectional = bool(data.get('bidirectional', True))
+    
+    if rule_type not in ['couple', 'household', 'manager', 'custom']:
+        return jsonify({'success': False, 'message': 'Invalid rule type'}), 400
+    
+    if len(participant_ids) < 2:
+        return jsonify({'success': False, 'message': 'Need at least 2 participants'}), 400
+    
+    found = Participant.query.filter(
+        Participant.event_id == event_id,
+        Participant.participant_id.in_(participant_ids)
+    ).count()
+    if found != len(participant_ids):
+        return jsonify({'success': False, 'message': 'Unknown participant for this event'}), 400
+    
+    if bidirectional:
+        pairs = [(a, b) for i, a in enumerate(participant_ids) for b in participant_ids[i + 1:]]
+    else:
+        pairs = [(participant_ids[0], b) for b in participant_ids[1:]]
+    
+    existing = {
+        (r.giver_id, r.receiver_id)
+        for r in ExclusionRule.query.filter_by(event_id=event_id).all()
+    }
+    new_rules = [
+        ExclusionRule(
+            event_id=event_id,
+            giver_id=giver_id,
+            receiver_id=receiver_id,
+            rule_type=rule_type,
+            bidirectional=bidirectional
+        )
+        for giver_id, receiver_id in pairs
+        if (giver_id, receiver_id) not in existing
+    ]
+    
+    try:
+        db.session.add_all(new_rules)
+        db.session.commit()
+        return jsonify({'success': True, 'message': f'{len(new_rules)} exclusion rules added'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@admin_bp.route('/event/<int:event_id>/exclusions/<int:rule_id>', methods=['DELETE'])
+@login_required
+def delete_exclusion(event_id, rule_id):
+    """Delete an exclusion rule"""
+    event = Event.query.get_or_404(event_id)
+    
+    if event.admin_id != current_user.user_id and current_user.role != 'super_admin':
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    rule = ExclusionRule.query.filter_by(event_id=event_id, rule_id=rule_id).first_or_404()
+    
+    try:
+        db.session.delete(rule)
+        db.session.commit()
+        return jsonify({'success': True, 'message': 'Exclusion rule removed'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
@@ -4,9 +4,10 @@ Analytics and Statistics routes
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from app import db
-from app.models import User, Event, Participant, Assignment, Wishlist, Message
+from app.models import User, Event, Participant, Wishlist, Message
 from datetime import datetime, timedelta
 from sqlalchemy import func
+from app.utils.assignment_store import assignment_totals, assignment_counts, event_assignments
 
 analytics_bp = Blueprint('analytics', __name__)
 
@@ -31,7 +32,8 @@ def platform_analytics():
     total_users = User.query.count()
     total_events = Event.query.count()
     total_participants = Participant.query.count()
-    total_assignments = Assignment.query.count()
+    # Packed events hold most of their pairs outside the assignments table
+    total_assignments, gift_status_dict = assignment_totals()
     total_wishlists = Wishlist.query.count()
     total_messages = Message.query.count()
     
@@ -53,14 +55,8 @@ def platform_analytics():
     recent_events = Event.query.filter(Event.created_at >= thirty_days_ago).count()
     
     # Assignments by gift status
-    gift_status_stats = db.session.query(
-        Assignment.gift_status,
-        func.count(Assignment.assignment_id)
-    ).group_by(Assignment.gift_status).all()
-    
-    gift_status_dict = {status: count for status, count in gift_status_stats}
-    gift_status_labels = [status or 'Unknown' for status, count in gift_status_stats]
-    gift_status_data = [count for status, count in gift_status_stats]
+    gift_status_labels = [status or 'Unknown' for status in gift_status_dict]
+    gift_status_data = list(gift_status_dict.values())
     
     # Events by privacy
     privacy_stats = db.session.query(
@@ -130,9 +126,8 @@ def user_analytics():
         Participant.event_id.in_([e.event_id for e in user_events])
     ).count()
     
-    total_assignments = Assignment.query.filter(
-        Assignment.event_id.in_([e.event_id for e in user_events])
-    ).count()
+    total_assignments, gift_status_dict = assignment_totals([e.event_id for e in user_events])
+    assignment_counts_by_event = assignment_counts([e.event_id for e in user_events])
     
     total_wishlists = Wishlist.query.filter(
         Wishlist.event_id.in_([e.event_id for e in user_events])
@@ -148,16 +143,8 @@ def user_analytics():
     events_by_status_data = list(events_by_status.values())
     
     # Gift status across all events
-    gift_status_stats = db.session.query(
-        Assignment.gift_status,
-        func.count(Assignment.assignment_id)
-    ).filter(
-        Assignment.event_id.in_([e.event_id for e in user_events])
-    ).group_by(Assignment.gift_status).all()
-    
-    gift_status_dict = {status: count for status, count in gift_status_stats}
-    gift_status_labels = [status or 'Unknown' for status, count in gift_status_stats]
-    gift_status_data = [count for status, count in gift_status_stats]
+    gift_status_labels = [status or 'Unknown' for status in gift_status_dict]
+    gift_status_data = list(gift_status_dict.values())
     
     # Participation rate
     avg_participants = total_participants / total_events if total_events > 0 else 0
@@ -178,6 +165,7 @@ def user_analytics():
         'gift_status_data': gift_status_data,
         'avg_participants': avg_participants,
         'assignment_rate': assignment_rate,
+        'assignment_counts': assignment_counts_by_event,
         'user_events': user_events
     }
     
@@ -196,19 +184,14 @@ def event_analytics(event_id):
     
     # Event statistics
     participants = Participant.query.filter_by(event_id=event_id, status='active').all()
-    assignments = Assignment.query.filter_by(event_id=event_id).all()
+    assignments = event_assignments(event_id)
     wishlists = Wishlist.query.filter_by(event_id=event_id).all()
     messages = Message.query.filter_by(event_id=event_id).all()
     
     # Gift status breakdown
-    gift_status_breakdown = db.session.query(
-        Assignment.gift_status,
-        func.count(Assignment.assignment_id)
-    ).filter_by(event_id=event_id).group_by(Assignment.gift_status).all()
-    
-    gift_status_dict = {status: count for status, count in gift_status_breakdown}
-    gift_status_labels = [status or 'Unknown' for status, count in gift_status_breakdown]
-    gift_status_data = [count for status, count in gift_status_breakdown]
+    _, gift_status_dict = assignment_totals([event_id])
+    gift_status_labels = [status or 'Unknown' for status in gift_status_dict]
+    gift_status_data = list(gift_status_dict.values())
     
     # Participation timeline
     participation_timeline = []
@@ -227,10 +210,10 @@ def event_analytics(event_id):
         is_read=False
     ).count()
     
-    # Assignment compatibility scores
-    avg_compatibility = db.session.query(
-        func.avg(Assignment.compatibility_score)
-    ).filter_by(event_id=event_id).scalar() or 0
+    # Assignment compatibility scores (packed pairs carry theirs too)
+    avg_compatibility = (
+        sum(a.compatibility_score or 0 for a in assignments) / len(assignments)
+    ) if assignments else 0
     
     # Create assignment lookup by giver_id
     assignment_by_giver = {a.giver_id: a for a in assignments}
@@ -5,6 +5,7 @@ from flask import Blueprint, jsonify, request
 from flask_login import login_required, current_user
 from app import db
 from app.models import Event, Participant, Wishlist, Message
+from app.utils.assignment_engine import schedule_rescore
 
 api_bp = Blueprint('api', __name__)
 
@@ -56,6 +57,9 @@ def save_wishlist():
     
     try:
         db.session.commit()
+        if participant.event.assignment_done:
+            # Keep the stored compatibility of this participant's pairs current
+            schedule_rescore(participant.event_id, participant.participant_id)
         return jsonify({'success': True, 'message': 'Wishlist saved successfully'})
     except Exception as e:
         db.session.rollback()
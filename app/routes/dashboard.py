@@ -4,7 +4,8 @@ Dashboard routes
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from app import db
-from app.models import User, Event, Participant, Assignment
+from app.models import User, Event, Participant
+from app.utils.assignment_store import giver_assignments
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -38,11 +39,9 @@ def index():
     # Get assignments for user
     assignments = []
     for participation in user_participations:
-        assignment = Assignment.query.filter_by(
-            event_id=participation.event_id,
-            giver_id=participation.participant_id
-        ).first()
-        if assignment:
+        # One per slot when the event has several gifts per person
+        given = giver_assignments(participation.event_id, participation.participant_id)
+        for assignment in given:
             receiver_participant = Participant.query.get(assignment.receiver_id)
             if receiver_participant:
                 assignments.append({
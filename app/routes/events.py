@@ -1,11 +1,14 @@
 """
 Event routes
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload
 from app import db
-from app.models import Event, Participant, Wishlist, Assignment
-from app.utils.helpers import generate_invite_code
+from app.models import Event, Participant, Wishlist
+from app.utils.assignment_store import giver_assignments
+from app.utils.invite_codes import next_invite_code
 from datetime import datetime
 import secrets
 
@@ -14,28 +17,53 @@ events_bp = Blueprint('events', __name__)
 @events_bp.route('/')
 @login_required
 def list_events():
-    """List all events (respecting privacy)"""
-    # Get all events user can see
-    all_events = Event.query.order_by(Event.created_at.desc()).all()
+    """List events the user may see (respecting privacy), newest first, one page at a time"""
+    # Admin of the event, participant in it, or the event is public to all
+    is_participant = db.session.query(Participant.participant_id).filter(
+        Participant.event_id == Event.event_id,
+        Participant.user_id == current_user.user_id
+    ).exists()
     
-    # Filter based on privacy settings
-    visible_events = []
-    for event in all_events:
-        # Admin can see all their events
-        if event.admin_id == current_user.user_id:
-            visible_events.append(event)
-        # Check if user is participant
-        elif Participant.query.filter_by(event_id=event.event_id, user_id=current_user.user_id).first():
-            visible_events.append(event)
-        # Public events visible to all
-        elif event.privacy_type == 'public' and event.visibility == 'all':
-            visible_events.append(event)
-        # Private events only visible to participants
-        elif event.privacy_type == 'private' and event.visibility == 'participants_only':
-            # Already checked above
-            pass
+    query = Event.query.filter(or_(
+        Event.admin_id == current_user.user_id,
+        is_participant,
+        and_(Event.privacy_type == 'public', Event.visibility == 'all')
+    ))
     
-    return render_template('events/list.html', events=visible_events)
+    # Keyset pagination: continue after the last (created_at, event_id) shown
+    cursor = _parse_cursor(request.args.get('after'))
+    if cursor:
+        created_at, event_id = cursor
+        query = query.filter(or_(
+            Event.created_at < created_at,
+            and_(Event.created_at == created_at, Event.event_id < event_id)
+        ))
+    
+    per_page = current_app.config.get('EVENTS_PER_PAGE', 24)
+    visible_events = query.order_by(Event.created_at.desc(), Event.event_id.desc()).limit(per_page + 1).all()
+    
+    next_cursor = None
+    if len(visible_events) > per_page:
+        visible_events = visible_events[:per_page]
+        last = visible_events[-1]
+        next_cursor = f"{last.created_at.isoformat()}_{last.event_id}"
+    
+    return render_template(
+        'events/list.html',
+        events=visible_events,
+        next_cursor=next_cursor,
+        paged=cursor is not None
+    )
+
+def _parse_cursor(value):
+    """'<created_at iso>_<event_id>' from the previous page, or None"""
+    if not value:
+        return None
+    try:
+        created_at, event_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(event_id)
+    except ValueError:
+        return None
 
 @events_bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -57,10 +85,8 @@ def create_event():
             flash('Event name is required.', 'error')
             return render_template('events/create.html')
         
-        # Generate unique invite code
-        invite_code = generate_invite_code()
-        while Event.query.filter_by(invite_code=invite_code).first():
-            invite_code = generate_invite_code()
+        # Unique by construction: no lookup needed
+        invite_code = next_invite_code()
         
         # Parse datetime fields safely
         gift_deadline_parsed = None
@@ -113,15 +139,16 @@ def create_event():
                 user_id=current_user.user_id
             )
             db.session.add(participant)
-            db.session.commit()
             
-            # Send email notification
+            # Email notification, committed with the event
             try:
                 from app.utils.email_service import send_event_created_email
                 send_event_created_email(event, current_user)
             except Exception as e:
                 print(f"Error sending email: {str(e)}")
             
+            db.session.commit()
+            
             flash(f'Event "{event_name}" created successfully!', 'success')
             return redirect(url_for('events.view_event', event_id=event.event_id))
         except Exception as e:
@@ -162,30 +189,32 @@ def view_event(event_id):
         flash('You do not have permission to view this event.', 'error')
         return redirect(url_for('events.list_events'))
     
-    participants = Participant.query.filter_by(event_id=event_id, status='active').all()
+    # Attendees with their users in one query; the template reads p.user for each
+    participants = Participant.query.options(joinedload(Participant.user)).filter_by(
+        event_id=event_id,
+        status='active'
+    ).all()
     
-    # Get assignment if exists
-    assignment = None
+    # Get assignments if they exist (one per gift slot)
+    assignments = []
     if participant:
-        assignment = Assignment.query.filter_by(
-            event_id=event_id,
-            giver_id=participant.participant_id
-        ).first()
+        assignments = giver_assignments(event_id, participant.participant_id)
+    if assignments:
+        # Receivers and their users in one query: given.receiver.user then hits the identity map
+        Participant.query.options(joinedload(Participant.user)).filter(
+            Participant.participant_id.in_([given.receiver_id for given in assignments])
+        ).all()
+    assignment = assignments[0] if assignments else None
     
-    # Get unread message count
+    # Get unread message count (one aggregate, the messages themselves are not needed here)
     from app.models import Message
     unread_count = 0
-    received_messages = []
     if participant:
-        received_messages = Message.query.filter_by(
-            event_id=event_id,
-            receiver_id=current_user.user_id
-        ).all()
-        unread_count = Message.query.filter_by(
-            event_id=event_id,
-            receiver_id=current_user.user_id,
-            is_read=False
-        ).count()
+        unread_count = db.session.query(func.count(Message.message_id)).filter(
+            Message.event_id == event_id,
+            Message.receiver_id == current_user.user_id,
+            Message.is_read == False
+        ).scalar()
     
     return render_template('events/view.html', 
                          event=event, 
@@ -193,7 +222,7 @@ def view_event(event_id):
                          is_admin=is_admin,
                          participants=participants,
                          assignment=assignment,
-                         received_messages=received_messages,
+                         assignments=assignments,
                          unread_count=unread_count)
 
 @events_bp.route('/join', methods=['GET', 'POST'])
@@ -234,22 +263,41 @@ def join_event():
         
         participant = Participant(
             event_id=event.event_id,
-            user_id=current_user.user_id
+            user_id=current_user.user_id,
+            group_key=request.form.get('group_key', '').strip()[:100] or None
         )
         
         try:
             db.session.add(participant)
-            db.session.commit()
             
-            # Send email notification to admin
+            # Late joiner: splice them into the existing pairings. If no pair
+            # can take them (exclusion rules, every gift already bought), the
+            # join still goes through: the joiner is told, and the admin's
+            # join email asks for a reshuffle, which assigns everyone.
+            assignment_error = None
+            if event.assignment_done:
+                db.session.flush()
+                from app.utils.assignment_engine import splice_in_participant
+                result = splice_in_participant(event.event_id, participant.participant_id)
+                if not result['success']:
+                    assignment_error = result['message']
+                    print(f"Could not assign late joiner: {assignment_error}")
+            
+            # Email notification to admin, committed with the join
             try:
                 from app.utils.email_service import send_participant_joined_email
+                db.session.flush()  # joined_at for the email
                 admin = event.creator
-                send_participant_joined_email(event, participant, admin)
+                send_participant_joined_email(event, participant, admin, assignment_error=assignment_error)
             except Exception as e:
                 print(f"Error sending email: {str(e)}")
             
+            db.session.commit()
+            
             flash(f'Successfully joined "{event.event_name}"!', 'success')
+            if assignment_error:
+                flash('Assignments were already made and you could not be added to them yet. '
+                      'The organizer has been asked to reshuffle; you will get an email with your assignment.', 'warning')
             return redirect(url_for('events.view_event', event_id=event.event_id))
         except Exception as e:
             db.session.rollback()
@@ -330,19 +378,17 @@ def edit_event(event_id):
         )
 
         try:
-            db.session.commit()
-
             # फक्त time बदलल्यासच सर्वांना ईमेल
             if time_changed:
                 try:
-                    from app.utils.email_service import send_event_status_email
-                    participants = Participant.query.filter_by(event_id=event_id, status='active').all()
-                    for participant in participants:
-                        # Status text मध्ये "rescheduled" दाखवू
-                        send_event_status_email(event, participant, 'rescheduled')
+                    from app.utils.email_service import send_event_status_emails
+                    # Status text मध्ये "rescheduled" दाखवू; one outbox row, committed with the change, mails everyone
+                    send_event_status_emails(event, 'rescheduled')
                 except Exception as e:
                     print(f"Error sending event update emails: {str(e)}")
 
+            db.session.commit()
+
             flash(f'Event "{event_name}" updated successfully!', 'success')
             return redirect(url_for('events.view_event', event_id=event_id))
         except Exception as e:
@@ -392,18 +438,17 @@ def end_event(event_id):
     
     try:
         event.status = new_status
-        db.session.commit()
 
         # फक्त cancel केल्यावरच participants ना ईमेल पाठवू
         if new_status == 'cancelled':
             try:
-                from app.utils.email_service import send_event_status_email
-                participants = Participant.query.filter_by(event_id=event_id, status='active').all()
-                for participant in participants:
-                    send_event_status_email(event, participant, new_status)
+                from app.utils.email_service import send_event_status_emails
+                send_event_status_emails(event, new_status)
             except Exception as e:
                 print(f"Error sending status emails: {str(e)}")
 
+        db.session.commit()
+
         return jsonify({
             'success': True, 
             'message': f'Event status changed to {new_status}',
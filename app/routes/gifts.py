@@ -5,6 +5,7 @@ from flask import Blueprint, jsonify, request
 from flask_login import login_required, current_user
 from app import db
 from app.models import Assignment, Participant
+from app.utils.assignment_store import assignment_for_update, release_if_pending
 
 gifts_bp = Blueprint('gifts', __name__)
 
@@ -19,15 +20,39 @@ def update_gift_status(assignment_id):
     if not giver_participant or giver_participant.user_id != current_user.user_id:
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
     
+    return _set_gift_status(assignment)
+
+@gifts_bp.route('/event/<int:event_id>/slot/<int:slot>/status', methods=['POST'])
+@login_required
+def update_slot_status(event_id, slot):
+    """Update the gift status of the current user's assignment in a slot (rows or packed)"""
+    participant = Participant.query.filter_by(
+        event_id=event_id,
+        user_id=current_user.user_id
+    ).first()
+    if not participant:
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    # A packed pair only gets its own row once its status changes
+    assignment = assignment_for_update(event_id, participant.participant_id, slot)
+    if not assignment:
+        return jsonify({'success': False, 'message': 'Assignment not found'}), 404
+    
+    return _set_gift_status(assignment)
+
+def _set_gift_status(assignment):
+    """Apply the posted status to an assignment row and commit"""
     data = request.get_json()
     new_status = data.get('status', '').strip()
     
     valid_statuses = ['pending', 'purchased', 'delivered']
     if new_status not in valid_statuses:
+        db.session.rollback()
         return jsonify({'success': False, 'message': 'Invalid status'}), 400
     
     try:
         assignment.gift_status = new_status
+        release_if_pending(assignment)
         db.session.commit()
         return jsonify({
             'success': True, 
@@ -4,7 +4,8 @@ Anonymous Messaging routes
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from app import db
-from app.models import Event, Participant, Message, Assignment
+from app.models import Event, Participant, Message
+from app.utils.assignment_store import giver_assignments
 
 messages_bp = Blueprint('messages', __name__)
 
@@ -61,18 +62,17 @@ def view_messages(event_id):
         is_read=False
     ).count()
     
-    # Get assignment to know who to message
-    assignment = None
+    # Get assignments to know who to message (one per gift slot)
+    assignments = []
     if participant:
-        assignment = Assignment.query.filter_by(
-            event_id=event_id,
-            giver_id=participant.participant_id
-        ).first()
+        assignments = giver_assignments(event_id, participant.participant_id)
+    assignment = assignments[0] if assignments else None
     
     return render_template('messages/chat.html', 
                          event=event, 
                          all_messages=all_messages,
                          assignment=assignment,
+                         assignments=assignments,
                          unread_count=unread_count)
 
 @messages_bp.route('/event/<int:event_id>/send', methods=['GET', 'POST'])
@@ -91,11 +91,12 @@ def send_message(event_id):
         flash('You are not a participant in this event.', 'error')
         return redirect(url_for('events.view_event', event_id=event_id))
     
-    # Get assignment to know receiver
-    assignment = Assignment.query.filter_by(
-        event_id=event_id,
-        giver_id=participant.participant_id
-    ).first()
+    # Get assignment to know receiver; the form names the slot when there are several
+    slot = request.form.get('slot', 0, type=int)
+    assignment = next(
+        (a for a in giver_assignments(event_id, participant.participant_id) if a.slot == slot),
+        None
+    )
     
     if not assignment:
         flash('You do not have an assignment yet. Wait for admin to generate assignments.', 'error')
@@ -130,7 +131,7 @@ def send_message(event_id):
             db.session.add(message)
             db.session.commit()
             
-            # Send email notification to receiver
+            # Email notification to receiver (batched into a digest)
             try:
                 from app.utils.email_service import send_new_message_email
                 send_new_message_email(message, receiver_participant.user, "Anonymous", event)
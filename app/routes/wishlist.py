@@ -5,6 +5,8 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from app import db
 from app.models import Event, Participant, Wishlist
+from app.utils.assignment_store import giver_assignments
+from app.utils.assignment_engine import schedule_rescore
 
 wishlist_bp = Blueprint('wishlist', __name__)
 
@@ -64,6 +66,9 @@ def manage_wishlist(event_id):
         
         try:
             db.session.commit()
+            if event.assignment_done:
+                # Keep the stored compatibility of this participant's pairs current
+                schedule_rescore(event_id, participant.participant_id)
             flash('Wishlist saved successfully!', 'success')
             return redirect(url_for('events.view_event', event_id=event_id))
         except Exception as e:
@@ -88,22 +93,28 @@ def view_wishlist(event_id, user_id):
         flash('You are not a participant in this event.', 'error')
         return redirect(url_for('events.view_event', event_id=event_id))
     
-    # Get assignment
-    from app.models import Assignment
-    assignment = Assignment.query.filter_by(
-        event_id=event_id,
-        giver_id=current_participant.participant_id
-    ).first()
+    # Get assignment (any slot) whose receiver is this user
+    assignments = giver_assignments(event_id, current_participant.participant_id)
     
-    if not assignment:
+    if not assignments:
         flash('Assignment not found.', 'error')
         return redirect(url_for('events.view_event', event_id=event_id))
     
     # Get receiver's participant
-    receiver_participant = Participant.query.get(assignment.receiver_id)
-    if not receiver_participant or receiver_participant.user_id != user_id:
+    receivers = {
+        p.participant_id: p
+        for p in Participant.query.filter(
+            Participant.participant_id.in_([a.receiver_id for a in assignments])
+        ).all()
+    }
+    assignment = next(
+        (a for a in assignments if a.receiver_id in receivers and receivers[a.receiver_id].user_id == user_id),
+        None
+    )
+    if not assignment:
         flash('You can only view your assigned receiver\'s wishlist.', 'error')
         return redirect(url_for('events.view_event', event_id=event_id))
+    receiver_participant = receivers[assignment.receiver_id]
     
     # Get wishlist
     wishlist = Wishlist.query.filter_by(
@@ -1,101 +1,555 @@
 """
 Smart Assignment Engine for Secret Santa
 """
+from flask import current_app
 from app import db
-from app.models import Participant, Assignment, Wishlist
+from app.models import Event, Participant, Assignment, Wishlist, ExclusionRule
+from app.utils.matching import is_allowed, is_single_cycle, cycle_lengths
+from app.utils.pairing_history import PairingHistory
+from app.utils.assignment_problem import AssignmentProblem, score_candidates
+from app.utils.process_pool import run_tasks
+from app.utils.assignment_store import (
+    PackedAssignments, use_packed, load_packed, save_packed, delete_assignments, event_pairs, repair_store
+)
+from app.utils.compatibility import wishlist_features, score_pair
+from app.utils.scheduler import Debouncer
+from sqlalchemy import insert
+from datetime import datetime
 import random
 import json
 
 class SmartAssignmentEngine:
     """Intelligent assignment algorithm"""
     
-    def __init__(self, event_id):
+    # random: uniform random derangement, repaired around exclusion rules;
+    # compatibility: best total wishlist score;
+    # ring: one chain where the gift passes through everyone;
+    # sharded: random draw within each group (department, office), solved in parallel
+    MODES = ('random', 'compatibility', 'ring', 'sharded')
+    
+    # The compatibility matrix is N x N, so cap it well below what exhausts memory
+    MAX_COMPATIBILITY_SIZE = 10000
+    
+    # Each participant gives (and receives) at most this many gifts
+    MAX_GIFTS_PER_GIVER = 5
+    
+    # Upper bound on candidates solved for one preview
+    MAX_PREVIEW_CANDIDATES = 32
+    
+    def __init__(self, event_id, seed=None, history_years=None):
         self.event_id = event_id
+        self.event = Event.query.get(event_id)
+        self.gifts_per_giver = (self.event.gifts_per_giver if self.event else None) or 1
+        self.rng = random.Random(seed)
+        # Avoid pairings from the organizer's events in the last N years
+        if history_years is None:
+            history_years = current_app.config.get('ASSIGNMENT_HISTORY_YEARS', 0)
+        self.history_years = history_years
+        # Fixed order: the same seed must always give the same assignments
         self.participants = Participant.query.filter_by(
             event_id=event_id,
             status='active'
-        ).all()
+        ).order_by(Participant.participant_id).all()
+        self.features = self._prefetch_features()
+        self.problem = self._build_problem()
+    
+    def _prefetch_features(self):
+        """Load every wishlist for the event in one query, keyed by participant"""
+        wishlists = {
+            w.user_id: w
+            for w in Wishlist.query.filter_by(event_id=self.event_id).all()
+        }
+        return {
+            p.participant_id: wishlist_features(wishlists.get(p.user_id))
+            for p in self.participants
+        }
     
-    def generate_assignments(self):
-        """Generate smart assignments"""
+    def _build_problem(self):
+        """Plain-data copy of the participants and settings for the solvers"""
+        config = current_app.config
+        return AssignmentProblem(
+            [p.participant_id for p in self.participants],
+            gifts_per_giver=self.gifts_per_giver,
+            features=self.features,
+            group_keys={p.participant_id: p.group_key or None for p in self.participants},
+            mix_groups=bool(self.event and self.event.mix_groups),
+            min_shard_size=config.get('ASSIGNMENT_MIN_SHARD_SIZE', 10),
+            max_shard_size=config.get('ASSIGNMENT_SHARD_SIZE', 20000),
+            workers=self._pool_workers()
+        )
+    
+    def _pool_workers(self):
+        """Worker processes for this event: spawning a pool costs more than solving a small event"""
+        config = current_app.config
+        if len(self.participants) < config.get('ASSIGNMENT_POOL_MIN_SIZE', 50000):
+            return 1
+        return max(1, config.get('ASSIGNMENT_POOL_WORKERS', 1))
+    
+    def _check_request(self, mode):
+        """Error result if the event cannot be assigned in this mode, else None"""
         if len(self.participants) < 2:
             return {'success': False, 'message': 'Need at least 2 participants'}
         
-        # Get existing assignments to avoid
-        existing_assignments = Assignment.query.filter_by(event_id=self.event_id).all()
-        existing_pairs = {(a.giver_id, a.receiver_id) for a in existing_assignments}
+        if mode not in self.MODES:
+            return {'success': False, 'message': f'Unknown assignment mode: {mode}'}
         
-        # Try multiple times to find valid assignment
-        max_attempts = 100
-        for attempt in range(max_attempts):
-            assignment_map = self._create_assignment_map()
-            
-            if assignment_map and self._is_valid_assignment(assignment_map, existing_pairs):
-                # Save assignments
-                for giver_id, receiver_id in assignment_map.items():
-                    assignment = Assignment(
-                        event_id=self.event_id,
-                        giver_id=giver_id,
-                        receiver_id=receiver_id,
-                        compatibility_score=self._calculate_compatibility(giver_id, receiver_id)
-                    )
-                    db.session.add(assignment)
-                
-                return {'success': True, 'message': 'Assignments generated successfully'}
-        
-        return {'success': False, 'message': 'Could not generate valid assignments after multiple attempts'}
-    
-    def _create_assignment_map(self):
-        """Create random assignment map"""
-        participant_ids = [p.participant_id for p in self.participants]
-        receiver_ids = participant_ids.copy()
-        random.shuffle(receiver_ids)
-        
-        assignment_map = {}
-        for i, giver_id in enumerate(participant_ids):
-            receiver_id = receiver_ids[i]
-            assignment_map[giver_id] = receiver_id
-        
-        return assignment_map
-    
-    def _is_valid_assignment(self, assignment_map, existing_pairs):
+        if mode == 'compatibility' and len(self.participants) > self.MAX_COMPATIBILITY_SIZE:
+            return {
+                'success': False,
+                'message': f'Compatibility mode supports up to {self.MAX_COMPATIBILITY_SIZE} participants'
+            }
+        
+        if self.gifts_per_giver >= len(self.participants):
+            return {
+                'success': False,
+                'message': f'{self.gifts_per_giver} gifts per person needs at least {self.gifts_per_giver + 1} participants'
+            }
+        
+        return None
+    
+    def _load_rules(self, replace):
+        """(forbidden, history): hard rules plus existing pairs, and past pairings to prefer to avoid"""
+        # Get existing assignments to avoid (a reshuffle starts from scratch)
+        existing_pairs = set()
+        if not replace:
+            # Pairs from every slot, so no giver draws a receiver twice
+            existing_pairs = set(event_pairs(self.event_id))
+        
+        return self._load_forbidden_pairs(existing_pairs), self._load_history_pairs()
+    
+    def generate_assignments(self, mode='random', replace=False, progress=None, fingerprint=None):
+        """
+        Generate smart assignments (replace=True swaps out the current ones).
+        progress, if given, is called with a percentage as each stage finishes.
+        fingerprint, if given, must match the one a preview returned; the
+        engine's seed then reproduces that previewed candidate exactly.
+        """
+        progress = progress or (lambda percent: None)
+        
+        error = self._check_request(mode)
+        if error:
+            return error
+        
+        forbidden, history = self._load_rules(replace)
+        progress(30)
+        
+        if fingerprint is not None and fingerprint != self.problem.fingerprint(forbidden, history):
+            return {
+                'success': False,
+                'message': 'Participants, groups or rules changed since the preview. Preview again.',
+                'stale': True
+            }
+        
+        try:
+            # Past pairings are only a preference; the hard rules still have to hold
+            slot_maps, blocked = self.problem.solve_preferring(mode, forbidden, history, self.rng)
+        except ImportError:
+            return {'success': False, 'message': 'Compatibility mode requires numpy and scipy'}
+        
+        progress(70)
+        
+        if blocked:
+            return {
+                'success': False,
+                'message': self._explain_infeasible(*blocked),
+                'blocked_givers': blocked[0]
+            }
+        
+        if slot_maps is None:
+            if mode == 'ring':
+                return {'success': False, 'message': 'Could not join everyone into a single gift chain with the current exclusion rules'}
+            return {
+                'success': False,
+                'message': f'Could not give everyone {self.gifts_per_giver} different receivers with the current exclusion rules'
+            }
+        
+        if not self._is_valid_assignment(slot_maps, forbidden):
+            return {'success': False, 'message': 'Could not generate valid assignments'}
+        
+        if mode == 'ring' and not all(is_single_cycle(m) for m in slot_maps):
+            return {'success': False, 'message': 'Could not generate a single gift chain'}
+        
+        # Last report before writing: the save belongs to the caller's transaction
+        progress(80)
+        self.save_assignments(slot_maps, replace=replace)
+        
+        # Stored so event pages can show it without walking the assignments
+        chain_length = max(cycle_lengths(slot_maps[0]))
+        self.event.chain_length = chain_length
+        
+        return {'success': True, 'message': 'Assignments generated successfully', 'chain_length': chain_length}
+    
+    def preview_assignments(self, mode='random', replace=False, candidates=8, top=3):
+        """
+        Dry run: solve `candidates` random seeds on the worker pool, score
+        each by wishlist compatibility and return the best `top`. Nothing is
+        written. Commit one by creating an engine with its seed and calling
+        generate_assignments with the returned fingerprint.
+        """
+        error = self._check_request(mode)
+        if error:
+            return error
+        
+        if mode == 'compatibility':
+            return {'success': False, 'message': 'Compatibility mode already picks the best draw; generate it directly'}
+        
+        candidates = max(1, min(candidates, self.MAX_PREVIEW_CANDIDATES))
+        forbidden, history = self._load_rules(replace)
+        seeds = [self.rng.getrandbits(32) for _ in range(candidates)]
+        
+        # One task per worker, so the problem is pickled once per process
+        workers = max(1, min(self.problem.workers, candidates))
+        tasks = [
+            (self.problem, mode, forbidden, history, seeds[i::workers])
+            for i in range(workers)
+        ]
+        scored = [c for batch in run_tasks(score_candidates, tasks, workers) for c in batch]
+        
+        if not scored:
+            return {'success': False, 'message': 'No valid assignment found with the current exclusion rules'}
+        
+        scored.sort(key=lambda c: (c['score'], c['lowest_score']), reverse=True)
+        return {
+            'success': True,
+            'message': f'{len(scored)} of {candidates} candidates scored',
+            'mode': mode,
+            'fingerprint': self.problem.fingerprint(forbidden, history),
+            'candidates': scored[:top]
+        }
+    
+    def save_assignments(self, slot_maps, replace=False):
+        """
+        Write one assignment map per slot with one bulk INSERT (executemany)
+        instead of one ORM object per row. Events of ASSIGNMENT_COMPACT_SIZE
+        participants or more are written as a single packed AssignmentSet row
+        instead (see assignment_store). With replace=True the event's current
+        pairs are removed by set-based DELETEs first. Nothing is committed here,
+        so the caller's commit makes the whole swap atomic.
+        """
+        if replace:
+            delete_assignments(self.event_id)
+        
+        existing = None if replace else load_packed(self.event_id)
+        if existing is not None or use_packed(len(self.participants)):
+            packed = self._pack(slot_maps, existing)
+            if packed is not None:
+                save_packed(self.event_id, packed)
+                return
+        
+        assigned_at = datetime.utcnow()
+        rows = [
+            {
+                'event_id': self.event_id,
+                'giver_id': giver_id,
+                'receiver_id': receiver_id,
+                'slot': slot,
+                'compatibility_score': self._calculate_compatibility(giver_id, receiver_id),
+                'assigned_at': assigned_at,
+                'gift_status': 'pending'
+            }
+            for slot, assignment_map in enumerate(slot_maps)
+            for giver_id, receiver_id in assignment_map.items()
+        ]
+        
+        if rows:
+            db.session.execute(insert(Assignment), rows)
+    
+    def _pack(self, slot_maps, existing=None):
+        """Packed form of slot_maps, added to an existing set; None if ids are too sparse"""
+        if existing is None:
+            return PackedAssignments.from_slot_maps(slot_maps, self._calculate_compatibility)
+        
+        for slot, assignment_map in enumerate(slot_maps):
+            for giver_id, receiver_id in assignment_map.items():
+                existing.set_pair(slot, giver_id, receiver_id, self._calculate_compatibility(giver_id, receiver_id))
+        return existing
+    
+    def _load_forbidden_pairs(self, existing_pairs=()):
+        """Collect exclusion rules and existing pairs as giver -> {receivers}"""
+        forbidden = load_forbidden_pairs(self.event_id)
+        for giver_id, receiver_id in existing_pairs:
+            forbidden.setdefault(giver_id, set()).add(receiver_id)
+        
+        return forbidden
+    
+    def _load_history_pairs(self):
+        """Past pairings of this organizer's events mapped onto current participants"""
+        if not self.history_years:
+            return {}
+        
+        if not self.event:
+            return {}
+        
+        history = PairingHistory.load(self.event.admin_id, self.history_years, exclude_event_id=self.event_id)
+        return history.forbidden_for(self.participants)
+    
+    def _explain_infeasible(self, giver_ids, receiver_ids):
+        """Describe the group of givers that the exclusion rules leave short"""
+        by_id = {p.participant_id: p for p in self.participants}
+        
+        def names(ids, limit=10):
+            listed = sorted(by_id[pid].user.name for pid in list(ids)[:limit] if pid in by_id)
+            if len(ids) > limit:
+                listed.append(f'and {len(ids) - limit} more')
+            return ', '.join(listed)
+        
+        if not receiver_ids:
+            return f'No valid assignment: {names(giver_ids)} is excluded from giving to everyone.'
+        
+        return (
+            f'No valid assignment: {len(giver_ids)} givers ({names(giver_ids)}) '
+            f'can only give to {len(receiver_ids)} people ({names(receiver_ids)}). '
+            f'Remove an exclusion rule for one of them.'
+        )
+    
+    def _is_valid_assignment(self, slot_maps, forbidden):
         """Check if assignment is valid"""
-        # No self-assignment
-        for giver_id, receiver_id in assignment_map.items():
-            if giver_id == receiver_id:
-                return False
+        taken = set()
+        for assignment_map in slot_maps:
+            # No self-assignment, no excluded or existing pairs, no pair from an earlier slot
+            for pair in assignment_map.items():
+                if not is_allowed(*pair, forbidden) or pair in taken:
+                    return False
             
-            # Avoid existing pairs
-            if (giver_id, receiver_id) in existing_pairs:
+            # Each receiver should be unique within a slot
+            receivers = list(assignment_map.values())
+            if len(receivers) != len(set(receivers)):
                 return False
-        
-        # Each receiver should be unique
-        receivers = list(assignment_map.values())
-        if len(receivers) != len(set(receivers)):
-            return False
+            
+            taken.update(assignment_map.items())
         
         return True
     
     def _calculate_compatibility(self, giver_id, receiver_id):
-        """Calculate compatibility score based on wishlists"""
-        giver_participant = Participant.query.get(giver_id)
-        receiver_participant = Participant.query.get(receiver_id)
-        
-        if not giver_participant or not receiver_participant:
+        """Calculate compatibility score from the prefetched wishlists"""
+        if giver_id not in self.features or receiver_id not in self.features:
             return 0.0
         
-        receiver_wishlist = Wishlist.query.filter_by(
-            user_id=receiver_participant.user_id,
-            event_id=self.event_id
-        ).first()
-        
-        if not receiver_wishlist:
-            return 0.5  # Default score if no wishlist
+        return score_pair(self.features[giver_id], self.features[receiver_id])
+
+
+def load_forbidden_pairs(event_id, participant_ids=None):
+    """Exclusion rules for an event as giver -> {receivers}, optionally for a few participants"""
+    query = db.session.query(
+        ExclusionRule.giver_id,
+        ExclusionRule.receiver_id,
+        ExclusionRule.bidirectional
+    ).filter_by(event_id=event_id)
+    
+    if participant_ids is not None:
+        query = query.filter(
+            ExclusionRule.giver_id.in_(participant_ids) | ExclusionRule.receiver_id.in_(participant_ids)
+        )
+    
+    forbidden = {}
+    for giver_id, receiver_id, bidirectional in query.all():
+        forbidden.setdefault(giver_id, set()).add(receiver_id)
+        if bidirectional:
+            forbidden.setdefault(receiver_id, set()).add(giver_id)
+    
+    return forbidden
+
+
+def _pair_scores(event_id, pairs):
+    """Compatibility scores for a handful of pairs using two queries"""
+    participant_ids = {pid for pair in pairs for pid in pair}
+    user_ids = dict(db.session.query(
+        Participant.participant_id,
+        Participant.user_id
+    ).filter(Participant.participant_id.in_(participant_ids)).all())
+    
+    wishlists = {
+        w.user_id: w
+        for w in Wishlist.query.filter(
+            Wishlist.event_id == event_id,
+            Wishlist.user_id.in_(list(user_ids.values()))
+        ).all()
+    }
+    features = {pid: wishlist_features(wishlists.get(uid)) for pid, uid in user_ids.items()}
+    
+    return {
+        (giver_id, receiver_id): score_pair(features.get(giver_id), features.get(receiver_id))
+        for giver_id, receiver_id in pairs
+    }
+
+
+def rescore_participants(event_id, participant_ids):
+    """
+    Recompute compatibility_score for every pair given or received by
+    participant_ids after their wishlists changed. A score depends on both
+    wishlists, so both directions are rescored; no other pair is touched.
+    Commits, and returns the number of pairs rescored.
+    """
+    store = repair_store(event_id)
+    pairs = store.touching(set(participant_ids))
+    if not pairs:
+        return 0
+    
+    scores = _pair_scores(event_id, [(pair.giver_id, pair.receiver_id) for pair in pairs])
+    for pair in pairs:
+        store.set_receiver(pair, pair.receiver_id, scores[(pair.giver_id, pair.receiver_id)])
+    store.save()
+    db.session.commit()
+    
+    return len(pairs)
+
+
+# Wishlist edits arrive in bursts; rescore each event once things go quiet
+_rescore_queue = Debouncer(rescore_participants, 'WISHLIST_RESCORE_DELAY', default_delay=5.0)
+
+
+def schedule_rescore(event_id, participant_id):
+    """Queue a participant whose wishlist changed for a batched, debounced rescore"""
+    _rescore_queue.add(event_id, participant_id)
+
+
+def _update_chain_length(event_id, store, delta, keeps_ring):
+    """
+    Keep Event.chain_length right after a repair (call before changing pairs).
+    The value describes slot 0. A single ring stays a ring when one person is
+    spliced in or linked out; anything else would need a full walk, so the
+    value is cleared instead.
+    """
+    event = Event.query.get(event_id)
+    if not event or event.chain_length is None:
+        return
+    
+    was_ring = event.chain_length == store.slot_size()
+    event.chain_length = event.chain_length + delta if keeps_ring and was_ring else None
+
+
+def splice_in_participant(event_id, participant_id, rng=None):
+    """
+    Add a late joiner to existing assignments by splitting one pending pair
+    A -> B into A -> new -> B in every slot. Touches two pairs per slot;
+    nobody else is reshuffled. A pair is picked for every slot before any
+    pair changes, so the joiner is either fully spliced in or not at all.
+    Nothing is committed here.
+    """
+    rng = rng or random.Random()
+    store = repair_store(event_id)
+    
+    if store.has_giver(participant_id):
+        return {'success': True, 'message': 'Participant already has an assignment'}
+    
+    event = Event.query.get(event_id)
+    slots = (event.gifts_per_giver if event else None) or 1
+    forbidden = load_forbidden_pairs(event_id, [participant_id])
+    
+    # Across slots the new participant needs distinct givers and receivers
+    chosen = []
+    for slot in range(slots):
+        givers = {c.giver_id for c in chosen}
+        receivers = {c.receiver_id for c in chosen}
         
-        # Simple compatibility based on preferences
-        score = 0.5  # Base score
+        for candidate in store.sample_pending(rng, [participant_id], slot=slot):
+            giver_id, receiver_id = candidate.giver_id, candidate.receiver_id
+            if giver_id in givers or receiver_id in receivers:
+                continue
+            if not (is_allowed(giver_id, participant_id, forbidden)
+                    and is_allowed(participant_id, receiver_id, forbidden)):
+                continue
+            chosen.append(candidate)
+            break
+        else:
+            return {'success': False, 'message': 'No pending assignment could take the new participant; reshuffle instead'}
+    
+    _update_chain_length(event_id, store, 1, keeps_ring=True)
+    scores = _pair_scores(event_id, [
+        pair
+        for c in chosen
+        for pair in ((c.giver_id, participant_id), (participant_id, c.receiver_id))
+    ])
+    for candidate in chosen:
+        giver_id, receiver_id = candidate.giver_id, candidate.receiver_id
+        store.set_receiver(candidate, participant_id, scores[(giver_id, participant_id)])
+        store.add(participant_id, receiver_id, candidate.slot, scores[(participant_id, receiver_id)])
+    store.save()
+    
+    return {'success': True, 'message': 'Participant added to the existing assignments'}
+
+
+def close_gap_for_participant(event_id, participant_id, rng=None):
+    """
+    Remove a dropped participant X from the assignments, slot by slot. Their
+    giver G takes over X's receiver R (G -> R); if that pair is not allowed,
+    G and R are swapped into a random pending pair A -> B as G -> B and
+    A -> R instead. No giver may end up with the same receiver in two slots.
+    Every slot is planned before any pair changes, and pairs whose gift is
+    already purchased or delivered are never changed.
+    Nothing is committed here.
+    """
+    rng = rng or random.Random()
+    store = repair_store(event_id)
+    
+    incoming = store.by_receiver(participant_id)
+    outgoing = store.by_giver(participant_id)
+    
+    if not incoming and not outgoing:
+        return {'success': True, 'message': 'Participant had no assignments'}
+    
+    if set(incoming) != set(outgoing):
+        return {'success': False, 'message': 'Assignments for this participant are incomplete; reshuffle instead'}
+    
+    if any(a.gift_status != 'pending' for a in list(incoming.values()) + list(outgoing.values())):
+        return {
+            'success': False,
+            'message': 'A gift involving this participant is already purchased; their pairs were left as they are'
+        }
+    
+    givers = [a.giver_id for a in incoming.values()]
+    receivers = [a.receiver_id for a in outgoing.values()]
+    forbidden = load_forbidden_pairs(event_id, givers + receivers)
+    taken = store.receivers_by_giver(givers)
+    
+    # (pair, new receiver) changes, applied only once every slot has a plan
+    plan = []
+    planned = set()
+    linked_slots = set()
+    for slot in sorted(incoming):
+        giver_id, receiver_id = incoming[slot].giver_id, outgoing[slot].receiver_id
         
-        # Add score based on category match, etc.
-        # This is a simplified version - can be enhanced
+        if is_allowed(giver_id, receiver_id, forbidden) and receiver_id not in taken[giver_id]:
+            plan.append((incoming[slot], receiver_id))
+            linked_slots.add(slot)
+            taken[giver_id].discard(participant_id)
+            taken[giver_id].add(receiver_id)
+            continue
         
-        return min(score, 1.0)
+        avoid_ids = [participant_id, giver_id, receiver_id]
+        for candidate in store.sample_pending(rng, avoid_ids, slot=slot):
+            other_giver, other_receiver = candidate.giver_id, candidate.receiver_id
+            if (slot, other_giver) in planned:
+                continue
+            if other_giver not in taken:
+                taken.update(store.receivers_by_giver([other_giver]))
+            # forbidden already holds every rule touching giver_id or receiver_id
+            if not (is_allowed(giver_id, other_receiver, forbidden)
+                    and is_allowed(other_giver, receiver_id, forbidden)):
+                continue
+            if other_receiver in taken[giver_id] or receiver_id in taken[other_giver]:
+                continue
+            
+            plan.append((incoming[slot], other_receiver))
+            plan.append((candidate, receiver_id))
+            planned.add((slot, other_giver))
+            taken[giver_id].discard(participant_id)
+            taken[giver_id].add(other_receiver)
+            taken[other_giver].discard(other_receiver)
+            taken[other_giver].add(receiver_id)
+            break
+        else:
+            return {'success': False, 'message': 'No pending assignment could close the gap; reshuffle instead'}
+    
+    # Slot 0 stays one ring only if its gap was closed by a direct link
+    _update_chain_length(event_id, store, -1, keeps_ring=0 in linked_slots)
+    scores = _pair_scores(event_id, [(pair.giver_id, new_receiver) for pair, new_receiver in plan])
+    # Drop X's pairs first, then apply each slot's plan backwards (A -> R
+    # before G -> B), so every receiver is free by the time it is taken
+    for pair in outgoing.values():
+        store.remove(pair)
+    for pair, new_receiver in reversed(plan):
+        store.set_receiver(pair, new_receiver, scores[(pair.giver_id, new_receiver)])
+    store.save()
+    
+    return {'success': True, 'message': 'Assignments repaired'}
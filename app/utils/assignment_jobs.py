@@ -0,0 +1,225 @@
+"""
+Background assignment jobs
+
+Very large events can take longer to assign than a gunicorn worker is allowed
+to spend on one request. start_assignment_job records an AssignmentJob row,
+hands the work to a worker process and returns at once; the admin dashboard
+polls the job row for progress.
+
+Only one job may be queued or running per event. A job whose worker died
+(a restart, a broken pool) would hold that slot forever, so every progress
+report refreshes updated_at, and a job with no sign of life for
+ASSIGNMENT_JOB_TIMEOUT seconds is marked failed the next time someone
+starts a job for its event. A job whose future fails is marked failed at
+once by a done-callback.
+"""
+from flask import current_app
+from sqlalchemy import func, update
+from app import db
+from app.models import Event, AssignmentJob
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+import functools
+import multiprocessing
+
+_executor = None
+_worker_app = None
+
+
+def _get_executor():
+    """Process pool shared by every job in this web worker"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=current_app.config.get('ASSIGNMENT_JOB_WORKERS', 2),
+            # Fresh interpreters: never inherit the web worker's DB connections
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor
+
+
+def expire_stale_jobs(event_id):
+    """Mark the event's queued or running jobs with no progress for ASSIGNMENT_JOB_TIMEOUT as failed"""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('ASSIGNMENT_JOB_TIMEOUT', 1800))
+    db.session.execute(
+        update(AssignmentJob)
+        .where(
+            AssignmentJob.event_id == event_id,
+            AssignmentJob.status.in_(['queued', 'running']),
+            func.coalesce(AssignmentJob.updated_at, AssignmentJob.created_at) < cutoff
+        )
+        .values(status='failed', message='Timed out: the worker stopped reporting', finished_at=datetime.utcnow())
+    )
+
+
+def active_job_for_event(event_id):
+    """Queued or running job for an event, if any (stale jobs are expired first, uncommitted)"""
+    expire_stale_jobs(event_id)
+    return AssignmentJob.query.filter(
+        AssignmentJob.event_id == event_id,
+        AssignmentJob.status.in_(['queued', 'running'])
+    ).first()
+
+
+def start_assignment_job(event_id, user_id, mode='random', replace=False, seed=None, fingerprint=None):
+    """
+    Record a job, queue it on the worker pool and return (job, None) at once,
+    or (None, active job) when the event already has one. seed and
+    fingerprint commit a previewed candidate, as commit_preview does inline.
+    """
+    # Lock the event row so two requests cannot both pass the check below
+    # (SELECT ... FOR UPDATE where the database has it)
+    db.session.query(Event.event_id).filter_by(event_id=event_id).with_for_update().first()
+
+    running = active_job_for_event(event_id)
+    if running:
+        db.session.commit()
+        return None, running
+
+    job = AssignmentJob(
+        event_id=event_id,
+        requested_by=user_id,
+        mode=mode,
+        replace=replace,
+        seed=seed,
+        fingerprint=fingerprint,
+        status='queued',
+        progress=0
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    try:
+        future = _get_executor().submit(run_assignment_job, job.job_id, current_app.config['CONFIG_NAME'])
+    except Exception as e:
+        _discard_broken_executor(e)
+        _fail_job(job.job_id, f'Could not start the job: {str(e)}')
+        db.session.refresh(job)
+        return job, None
+
+    future.add_done_callback(functools.partial(_job_finished, current_app._get_current_object(), job.job_id))
+    return job, None
+
+
+def _discard_broken_executor(error):
+    """Drop a pool whose worker died, so the next job gets a fresh one"""
+    global _executor
+    if isinstance(error, BrokenProcessPool):
+        _executor = None
+
+
+def _fail_job(job_id, message):
+    """Mark a job failed unless it already finished"""
+    with db.engine.begin() as connection:
+        connection.execute(
+            AssignmentJob.__table__.update()
+            .where(AssignmentJob.job_id == job_id, AssignmentJob.status.in_(['queued', 'running']))
+            .values(status='failed', message=message[:255], finished_at=datetime.utcnow())
+        )
+
+
+def _finish_job(job_id, status, message, **values):
+    """
+    Move a job out of queued/running inside the session's transaction.
+    Returns False, changing nothing, when it already left them (expired).
+    """
+    result = db.session.execute(
+        AssignmentJob.__table__.update()
+        .where(AssignmentJob.job_id == job_id, AssignmentJob.status.in_(['queued', 'running']))
+        .values(status=status, message=message[:255], finished_at=datetime.utcnow(), **values)
+    )
+    return result.rowcount == 1
+
+
+def _job_finished(app, job_id, future):
+    """Done-callback (executor thread): record a job whose worker raised or died"""
+    if future.cancelled():
+        error = 'Job was cancelled'
+    elif future.exception() is not None:
+        _discard_broken_executor(future.exception())
+        error = f'Worker failed: {str(future.exception())}'
+    else:
+        return
+
+    try:
+        with app.app_context():
+            _fail_job(job_id, error)
+    except Exception as e:
+        print(f"Error recording failed job {job_id}: {str(e)}")
+
+
+def run_assignment_job(job_id, config_name):
+    """Worker process entry point"""
+    global _worker_app
+    if _worker_app is None:
+        from app import create_app
+        _worker_app = create_app(config_name)
+
+    with _worker_app.app_context():
+        execute_assignment_job(job_id)
+
+
+def _report_progress(job_id, percent):
+    """Write progress on its own connection so it is visible before the job commits"""
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(
+                AssignmentJob.__table__.update()
+                .where(AssignmentJob.job_id == job_id, AssignmentJob.status.in_(['queued', 'running']))
+                .values(status='running', progress=percent, updated_at=datetime.utcnow())
+            )
+    except Exception as e:
+        # Progress is cosmetic; never fail the job over it
+        print(f"Error reporting job progress: {str(e)}")
+
+
+def execute_assignment_job(job_id):
+    """
+    Run the engine for a job. Assignments, the event flags, the givers'
+    notification and the job's final status are committed together, so a
+    crash leaves no half-written assignments (or emails about them) behind.
+    """
+    from app.utils.assignment_engine import SmartAssignmentEngine
+    from app.utils.email_service import send_assignment_emails
+
+    job = AssignmentJob.query.get(job_id)
+    if not job or job.status not in ['queued', 'running']:
+        return
+
+    _report_progress(job_id, 5)
+
+    try:
+        event = Event.query.get(job.event_id)
+        engine = SmartAssignmentEngine(job.event_id, seed=job.seed)
+        _report_progress(job_id, 15)
+
+        # A stale fingerprint fails the job like any other unsolvable request
+        result = engine.generate_assignments(
+            mode=job.mode,
+            replace=job.replace,
+            progress=lambda percent: _report_progress(job_id, percent),
+            fingerprint=job.fingerprint
+        )
+
+        if not result['success']:
+            db.session.rollback()
+            _finish_job(job_id, 'failed', result.get('message', ''))
+            db.session.commit()
+            return
+
+        # Conditional on the row as committed, not this transaction's
+        # snapshot: a job expired as stale while it ran writes nothing
+        if not _finish_job(job_id, 'done', result.get('message', ''), progress=100):
+            db.session.rollback()
+            return
+
+        event.assignment_done = True
+        if not job.replace:
+            event.status = 'active'
+        send_assignment_emails(event)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        _finish_job(job_id, 'failed', str(e))
+        db.session.commit()
@@ -0,0 +1,210 @@
+"""
+Assignment problems as plain data
+
+AssignmentProblem holds what the solvers need for one event (participant
+ids, group keys, wishlist features and settings) without any ORM objects,
+so it can be pickled to worker processes. SmartAssignmentEngine builds one
+from the database; previews solve copies of it with different seeds.
+
+Solving is deterministic for a given seed: the same problem, rules and
+seed always give the same assignments, which is how a previewed candidate
+is committed later without storing it.
+"""
+from app.utils.matching import (
+    sattolo_cycle, random_derangement, find_assignment, max_score_assignment, merge_forbidden, join_cycles,
+    cycle_lengths, disjoint_assignments
+)
+from app.utils.sharding import partition, solve_shards, mix_shards
+from app.utils.compatibility import score_pair, compatibility_matrix
+import copy
+import hashlib
+import random
+
+# Fresh draws of every slot before a multi-gift ring assignment gives up
+RING_RESTARTS = 20
+
+
+class AssignmentProblem:
+    """Participants and settings for one assignment run"""
+
+    def __init__(self, participant_ids, gifts_per_giver=1, features=None, group_keys=None,
+                 mix_groups=False, min_shard_size=10, max_shard_size=20000, workers=1):
+        self.participant_ids = list(participant_ids)
+        self.gifts_per_giver = gifts_per_giver
+        self.features = features or {}
+        self.group_keys = group_keys or {}
+        self.mix_groups = mix_groups
+        self.min_shard_size = min_shard_size
+        self.max_shard_size = max_shard_size
+        self.workers = workers
+        self._scores = None
+
+    def __getstate__(self):
+        # The compatibility matrix can be hundreds of MB; workers rebuild it
+        state = dict(self.__dict__)
+        state['_scores'] = None
+        return state
+
+    def solve_preferring(self, mode, forbidden, preferred, rng):
+        """Solve avoiding preferred pairs too; drop them if that is infeasible"""
+        if preferred:
+            slot_maps, blocked = self.solve(mode, merge_forbidden(forbidden, preferred), rng)
+            if slot_maps is not None:
+                return slot_maps, None
+
+        return self.solve(mode, forbidden, rng)
+
+    def solve(self, mode, forbidden, rng):
+        """
+        Build gifts_per_giver mutually disjoint assignment maps, returning
+        (slot_maps, blocked). Each slot is solved with the pairs of the
+        earlier slots forbidden, one matching per slot, so the slots are
+        independent draws.
+        """
+        if mode == 'sharded':
+            return self._sharded_maps(forbidden, rng)
+
+        k = self.gifts_per_giver
+
+        if mode == 'random' and k > 1:
+            return disjoint_assignments(self.participant_ids, k, forbidden, rng)
+
+        # A later ring slot can be boxed in by the earlier slots' random
+        # draws alone; drawing all slots again usually gets past it
+        attempts = RING_RESTARTS if mode == 'ring' and k > 1 else 1
+        for _ in range(attempts):
+            slot_maps, blocked, slot = self._solve_slots(mode, k, forbidden, rng)
+            if slot_maps is not None or slot == 0:
+                break
+
+        # Only the first slot is short because of the exclusion rules alone
+        return slot_maps, (blocked if slot == 0 else None)
+
+    def _solve_slots(self, mode, k, forbidden, rng):
+        """One draw of k disjoint slots: (slot_maps, None, None) or (None, blocked, failed slot)"""
+        slot_maps = []
+        taken = {}
+        for slot in range(k):
+            slot_forbidden = merge_forbidden(forbidden, taken) if taken else forbidden
+            assignment_map, blocked = self._solve_slot(mode, slot_forbidden, rng)
+            if assignment_map is None:
+                return None, blocked, slot
+
+            slot_maps.append(assignment_map)
+            for giver_id, receiver_id in assignment_map.items():
+                taken.setdefault(giver_id, set()).add(receiver_id)
+
+        return slot_maps, None, None
+
+    def _solve_slot(self, mode, forbidden, rng):
+        """Run the solver for mode, returning (assignment_map, blocked)"""
+        if mode == 'compatibility':
+            return self._compatibility_map(forbidden, rng)
+
+        # Ring mode starts from one cycle, which is already a ring without rules
+        assignment_map, blocked = self._random_map(forbidden, rng, single_cycle=(mode == 'ring'))
+
+        if mode == 'ring' and assignment_map and not join_cycles(assignment_map, forbidden, rng):
+            return None, None
+
+        return assignment_map, blocked
+
+    def _random_map(self, forbidden, rng, single_cycle=False):
+        """Create random assignment map, returning (assignment_map, blocked)"""
+        if not forbidden:
+            draw = sattolo_cycle if single_cycle else random_derangement
+            return dict(zip(self.participant_ids, draw(self.participant_ids, rng))), None
+
+        return find_assignment(self.participant_ids, forbidden, rng, single_cycle=single_cycle)
+
+    def _compatibility_map(self, forbidden, rng):
+        """Create the assignment map with the highest total compatibility"""
+        # Every slot (and the fallback without preferred pairs) reuses one matrix
+        if self._scores is None:
+            self._scores = compatibility_matrix([self.features.get(pid) for pid in self.participant_ids])
+
+        assignment_map = max_score_assignment(self.participant_ids, self._scores, forbidden, rng)
+
+        if assignment_map is None:
+            # Infeasible: let the matching solver name the blocking group
+            return find_assignment(self.participant_ids, forbidden, rng)
+
+        return assignment_map, None
+
+    def _sharded_maps(self, forbidden, rng):
+        """Assign within group_key shards on the worker pool, then stitch (and optionally mix) them"""
+        groups = {}
+        for pid in self.participant_ids:
+            groups.setdefault(self.group_keys.get(pid), []).append(pid)
+
+        shards = partition(
+            groups,
+            max(self.min_shard_size, self.gifts_per_giver + 1),
+            self.max_shard_size,
+            rng
+        )
+        slot_maps, blocked = solve_shards(shards, self.gifts_per_giver, forbidden, rng, workers=self.workers)
+
+        if slot_maps is not None and self.mix_groups:
+            mix_shards(slot_maps, shards, forbidden, rng)
+
+        return slot_maps, blocked
+
+    def score(self, slot_maps):
+        """(average, lowest) compatibility over every pair in the slot maps"""
+        total = 0.0
+        lowest = None
+        count = 0
+        for assignment_map in slot_maps:
+            for giver_id, receiver_id in assignment_map.items():
+                value = score_pair(self.features.get(giver_id), self.features.get(receiver_id))
+                total += value
+                count += 1
+                lowest = value if lowest is None else min(lowest, value)
+
+        return (total / count if count else 0.0), (lowest or 0.0)
+
+    def fingerprint(self, *pair_maps):
+        """
+        Hash of everything that decides the result for a seed: participants,
+        groups, wishlists, settings and the giver -> {receivers} maps given.
+        """
+        digest = hashlib.sha256()
+        digest.update(repr((self.gifts_per_giver, self.mix_groups, self.min_shard_size, self.max_shard_size)).encode())
+
+        for pid in self.participant_ids:
+            features = self.features.get(pid)
+            if features is not None:
+                tags, category, completeness = features
+                features = (sorted(tags), category, completeness)
+            digest.update(repr((pid, self.group_keys.get(pid), features)).encode())
+
+        for pairs in pair_maps:
+            digest.update(b'|')
+            for giver_id in sorted(pairs):
+                digest.update(repr((giver_id, sorted(pairs[giver_id]))).encode())
+
+        return digest.hexdigest()
+
+
+def score_candidates(problem, mode, forbidden, preferred, seeds):
+    """Worker entry point: solve and score one candidate per seed"""
+    # Candidates already run in parallel; shards inside them stay in process
+    problem = copy.copy(problem)
+    problem.workers = 1
+
+    candidates = []
+    for seed in seeds:
+        slot_maps, _ = problem.solve_preferring(mode, forbidden, preferred, random.Random(seed))
+        if slot_maps is None:
+            continue
+
+        average, lowest = problem.score(slot_maps)
+        candidates.append({
+            'seed': seed,
+            'score': round(average, 4),
+            'lowest_score': round(lowest, 4),
+            'chain_length': max(cycle_lengths(slot_maps[0]))
+        })
+
+    return candidates
@@ -0,0 +1,610 @@
+"""
+Assignment storage
+
+Small events keep one Assignment row per pair. Events with at least
+ASSIGNMENT_COMPACT_SIZE participants can store all their pairs in a single
+AssignmentSet row instead: flat int32 arrays indexed by
+``slot * span + participant_id - base_id``, one for giver -> receiver and
+one for the inverse. Looking up a pair is one array access, or one SUBSTR of
+the blob when only a single pair is needed.
+
+A packed pair only gets an Assignment row once its gift_status leaves
+'pending'; that row then carries the status (and the same pair). Reads and
+repairs go through the helpers here so callers work with either layout.
+"""
+from flask import current_app
+from app import db
+from app.models import Event, Participant, Assignment, AssignmentSet
+from sqlalchemy import delete, func
+from array import array
+from datetime import datetime
+import sys
+
+# Ids this sparse (span per participant) are kept as rows instead
+MAX_SPAN_RATIO = 4
+
+# Scores are stored as uint16 fractions of 1.0
+SCORE_SCALE = 65535
+
+
+def _pack(values):
+    """Array -> little-endian bytes"""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack(typecode, data):
+    """Little-endian bytes -> array"""
+    values = array(typecode)
+    values.frombytes(bytes(data))
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+class PackedAssignments:
+    """Assignment maps for every slot packed into flat arrays, with O(1) lookups both ways"""
+
+    def __init__(self, base_id, span, slots, receivers=None, givers=None, scores=None):
+        self.base_id = base_id
+        self.span = span
+        self.slots = slots
+        size = span * slots
+        self.receivers = receivers if receivers is not None else array('i', [0]) * size
+        self.givers = givers if givers is not None else array('i', [0]) * size
+        self.scores = scores if scores is not None else array('H', [0]) * size
+        self.pair_count = sum(1 for receiver_id in self.receivers if receiver_id)
+
+    @classmethod
+    def from_slot_maps(cls, slot_maps, score=None):
+        """
+        Pack giver -> receiver maps (one per slot). score(giver_id,
+        receiver_id), if given, is stored per pair. Returns None when the
+        participant ids are too sparse for the packed layout to pay off.
+        """
+        ids = {pid for assignment_map in slot_maps for pair in assignment_map.items() for pid in pair}
+        if not ids:
+            return None
+
+        base_id = min(ids)
+        span = max(ids) - base_id + 1
+        if span > MAX_SPAN_RATIO * len(ids):
+            return None
+
+        packed = cls(base_id, span, len(slot_maps))
+        for slot, assignment_map in enumerate(slot_maps):
+            for giver_id, receiver_id in assignment_map.items():
+                packed.set_pair(slot, giver_id, receiver_id, score(giver_id, receiver_id) if score else 0.0)
+
+        return packed
+
+    @classmethod
+    def from_row(cls, row):
+        """Unpack an AssignmentSet row"""
+        return cls(
+            row.base_id,
+            row.span,
+            row.slots,
+            _unpack('i', row.receivers),
+            _unpack('i', row.givers),
+            _unpack('H', row.scores)
+        )
+
+    def to_row(self, row):
+        """Write the arrays into an AssignmentSet row"""
+        row.base_id = self.base_id
+        row.span = self.span
+        row.slots = self.slots
+        row.pair_count = self.pair_count
+        row.receivers = _pack(self.receivers)
+        row.givers = _pack(self.givers)
+        row.scores = _pack(self.scores)
+        return row
+
+    def __len__(self):
+        return self.pair_count
+
+    def _index(self, slot, pid):
+        """Array index for a participant in a slot, or None outside the packed range"""
+        offset = pid - self.base_id
+        if 0 <= offset < self.span and 0 <= slot < self.slots:
+            return slot * self.span + offset
+        return None
+
+    def receiver_of(self, giver_id, slot=0):
+        """Receiver of giver_id in slot, or None"""
+        i = self._index(slot, giver_id)
+        return (self.receivers[i] or None) if i is not None else None
+
+    def giver_of(self, receiver_id, slot=0):
+        """Giver to receiver_id in slot, or None"""
+        i = self._index(slot, receiver_id)
+        return (self.givers[i] or None) if i is not None else None
+
+    def score_of(self, giver_id, slot=0):
+        """Stored compatibility score of giver_id's pair in slot"""
+        i = self._index(slot, giver_id)
+        return self.scores[i] / SCORE_SCALE if i is not None else 0.0
+
+    def set_pair(self, slot, giver_id, receiver_id, score=0.0):
+        """Give giver_id's slot to receiver_id, replacing both their old links"""
+        self._cover(giver_id)
+        self._cover(receiver_id)
+        self.remove_giver(slot, giver_id)
+        previous_giver = self.giver_of(receiver_id, slot)
+        if previous_giver is not None:
+            self.remove_giver(slot, previous_giver)
+
+        i = self._index(slot, giver_id)
+        self.receivers[i] = receiver_id
+        self.scores[i] = round(min(max(score, 0.0), 1.0) * SCORE_SCALE)
+        self.givers[self._index(slot, receiver_id)] = giver_id
+        self.pair_count += 1
+
+    def remove_giver(self, slot, giver_id):
+        """Drop giver_id's pair in slot, if any"""
+        receiver_id = self.receiver_of(giver_id, slot)
+        if receiver_id is None:
+            return
+
+        self.receivers[self._index(slot, giver_id)] = 0
+        self.scores[self._index(slot, giver_id)] = 0
+        self.givers[self._index(slot, receiver_id)] = 0
+        self.pair_count -= 1
+
+    def _cover(self, pid):
+        """Widen the packed range to include pid (late joiners get new, higher ids)"""
+        if self._index(0, pid) is not None:
+            return
+
+        base_id = min(self.base_id, pid)
+        span = max(self.base_id + self.span, pid + 1) - base_id
+        shift = self.base_id - base_id
+        for name, typecode in (('receivers', 'i'), ('givers', 'i'), ('scores', 'H')):
+            old = getattr(self, name)
+            new = array(typecode, [0]) * (span * self.slots)
+            for slot in range(self.slots):
+                start = slot * span + shift
+                new[start:start + self.span] = old[slot * self.span:(slot + 1) * self.span]
+            setattr(self, name, new)
+
+        self.base_id = base_id
+        self.span = span
+
+    def pairs(self):
+        """Yield (slot, giver_id, receiver_id) for every pair"""
+        for slot in range(self.slots):
+            start = slot * self.span
+            for offset in range(self.span):
+                receiver_id = self.receivers[start + offset]
+                if receiver_id:
+                    yield slot, self.base_id + offset, receiver_id
+
+    def slot_maps(self):
+        """giver -> receiver dict per slot"""
+        slot_maps = [{} for _ in range(self.slots)]
+        for slot, giver_id, receiver_id in self.pairs():
+            slot_maps[slot][giver_id] = receiver_id
+        return slot_maps
+
+
+class PackedPair:
+    """A packed pair with the attributes routes and templates read from an Assignment"""
+
+    assignment_id = None
+    gift_status = 'pending'
+
+    def __init__(self, event_id, giver_id, receiver_id, slot=0, compatibility_score=0.0, assigned_at=None):
+        self.event_id = event_id
+        self.giver_id = giver_id
+        self.receiver_id = receiver_id
+        self.slot = slot
+        self.compatibility_score = compatibility_score
+        self.assigned_at = assigned_at
+
+    @property
+    def giver(self):
+        return Participant.query.get(self.giver_id)
+
+    @property
+    def receiver(self):
+        return Participant.query.get(self.receiver_id)
+
+    @property
+    def event(self):
+        return Event.query.get(self.event_id)
+
+    def __repr__(self):
+        return f'<PackedPair {self.event_id}:{self.slot}:{self.giver_id}>'
+
+
+def use_packed(participant_count):
+    """Whether an event this large should be stored packed"""
+    threshold = current_app.config.get('ASSIGNMENT_COMPACT_SIZE', 0)
+    return bool(threshold) and participant_count >= threshold
+
+
+def load_packed(event_id):
+    """PackedAssignments for an event, or None when it is stored as rows"""
+    row = AssignmentSet.query.get(event_id)
+    return PackedAssignments.from_row(row) if row else None
+
+
+def save_packed(event_id, packed):
+    """Insert or update the event's AssignmentSet row (not committed)"""
+    row = AssignmentSet.query.get(event_id)
+    if row is None:
+        row = AssignmentSet(event_id=event_id)
+        db.session.add(row)
+    packed.to_row(row)
+    row.assigned_at = datetime.utcnow()
+    return row
+
+
+def delete_assignments(event_id):
+    """Remove every stored pair of an event, rows and packed, with set-based DELETEs"""
+    for model in (Assignment, AssignmentSet):
+        db.session.execute(
+            delete(model)
+            .where(model.event_id == event_id)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def giver_assignments(event_id, giver_id):
+    """
+    One giver's assignments ordered by slot: Assignment rows, or PackedPair
+    objects for packed pairs that never left 'pending'. A packed event only
+    reads the giver's few bytes of the blob, never the whole set.
+    """
+    rows = {
+        a.slot: a
+        for a in Assignment.query.filter_by(event_id=event_id, giver_id=giver_id)
+    }
+
+    meta = db.session.query(
+        AssignmentSet.base_id,
+        AssignmentSet.span,
+        AssignmentSet.slots,
+        AssignmentSet.assigned_at
+    ).filter_by(event_id=event_id).first()
+
+    packed = {}
+    if meta and 0 <= giver_id - meta.base_id < meta.span:
+        offsets = [slot * meta.span + giver_id - meta.base_id for slot in range(meta.slots)]
+        # SUBSTR is 1-based; 4 bytes per receiver, 2 per score
+        values = db.session.query(
+            *[func.substr(AssignmentSet.receivers, i * 4 + 1, 4) for i in offsets],
+            *[func.substr(AssignmentSet.scores, i * 2 + 1, 2) for i in offsets]
+        ).filter_by(event_id=event_id).first()
+
+        for slot in range(meta.slots):
+            receiver_id = _unpack('i', values[slot])[0]
+            if receiver_id:
+                score = _unpack('H', values[meta.slots + slot])[0] / SCORE_SCALE
+                packed[slot] = PackedPair(event_id, giver_id, receiver_id, slot, score, meta.assigned_at)
+
+    packed.update(rows)
+    return [packed[slot] for slot in sorted(packed)]
+
+
+def event_assignments(event_id):
+    """Every assignment of an event ordered by slot, rows overriding packed pairs"""
+    rows = Assignment.query.filter_by(event_id=event_id).order_by(Assignment.slot).all()
+    row = AssignmentSet.query.get(event_id)
+    if row is None:
+        return rows
+
+    packed = PackedAssignments.from_row(row)
+    overrides = {(a.slot, a.giver_id): a for a in rows}
+    return [
+        overrides.get((slot, giver_id)) or PackedPair(
+            event_id, giver_id, receiver_id, slot, packed.score_of(giver_id, slot), row.assigned_at
+        )
+        for slot, giver_id, receiver_id in packed.pairs()
+    ]
+
+
+def event_pairs(event_id):
+    """Every (giver_id, receiver_id) of an event without building objects"""
+    row = AssignmentSet.query.get(event_id)
+    if row is not None:
+        return [(giver_id, receiver_id) for _, giver_id, receiver_id in PackedAssignments.from_row(row).pairs()]
+
+    return db.session.query(Assignment.giver_id, Assignment.receiver_id).filter_by(event_id=event_id).all()
+
+
+def pending_givers(event_id):
+    """Participant ids with at least one gift still 'pending', rows or packed"""
+    row = AssignmentSet.query.get(event_id)
+    if row is None:
+        return {
+            giver_id for giver_id, in db.session.query(Assignment.giver_id).filter_by(
+                event_id=event_id,
+                gift_status='pending'
+            ).distinct()
+        }
+
+    # A packed pair only has a row once its status moved past 'pending'
+    done = set(db.session.query(Assignment.slot, Assignment.giver_id).filter(
+        Assignment.event_id == event_id,
+        Assignment.gift_status != 'pending'
+    ))
+    return {
+        giver_id for slot, giver_id, _ in PackedAssignments.from_row(row).pairs()
+        if (slot, giver_id) not in done
+    }
+
+
+def assignment_for_update(event_id, giver_id, slot):
+    """
+    The Assignment row of a giver's slot, writing one for a packed pair the
+    first time it is needed (a gift status change). None if there is no pair.
+    """
+    row = Assignment.query.filter_by(event_id=event_id, giver_id=giver_id, slot=slot).first()
+    if row:
+        return row
+
+    for pair in giver_assignments(event_id, giver_id):
+        if pair.slot == slot:
+            row = Assignment(
+                event_id=event_id,
+                giver_id=giver_id,
+                receiver_id=pair.receiver_id,
+                slot=slot,
+                compatibility_score=pair.compatibility_score,
+                assigned_at=pair.assigned_at,
+                gift_status='pending'
+            )
+            db.session.add(row)
+            return row
+
+    return None
+
+
+def release_if_pending(row):
+    """Drop the row of a packed pair that is back to 'pending'; the set still holds the pair"""
+    if row.gift_status != 'pending' or AssignmentSet.query.get(row.event_id) is None:
+        return
+
+    if row.assignment_id is None:
+        db.session.expunge(row)
+    else:
+        db.session.delete(row)
+
+
+def assignment_totals(event_ids=None):
+    """
+    (pair count, {gift_status: count}) over the given events (all when None),
+    counting packed pairs without unpacking them.
+    """
+    status_query = db.session.query(Assignment.gift_status, func.count(Assignment.assignment_id))
+    packed_query = db.session.query(func.coalesce(func.sum(AssignmentSet.pair_count), 0))
+    overlay_query = db.session.query(func.count(Assignment.assignment_id)).join(
+        AssignmentSet, Assignment.event_id == AssignmentSet.event_id
+    )
+
+    if event_ids is not None:
+        event_ids = list(event_ids)
+        status_query = status_query.filter(Assignment.event_id.in_(event_ids))
+        packed_query = packed_query.filter(AssignmentSet.event_id.in_(event_ids))
+        overlay_query = overlay_query.filter(Assignment.event_id.in_(event_ids))
+
+    by_status = dict(status_query.group_by(Assignment.gift_status).all())
+    # Rows of packed events duplicate packed pairs; the rest of those pairs are pending
+    pending_packed = packed_query.scalar() - overlay_query.scalar()
+    if pending_packed:
+        by_status['pending'] = by_status.get('pending', 0) + pending_packed
+
+    return sum(by_status.values()), by_status
+
+
+def assignment_counts(event_ids):
+    """{event_id: pair count} for several events in two queries"""
+    event_ids = list(event_ids)
+    counts = dict(db.session.query(
+        AssignmentSet.event_id,
+        AssignmentSet.pair_count
+    ).filter(AssignmentSet.event_id.in_(event_ids)).all())
+
+    for event_id, count in db.session.query(
+        Assignment.event_id,
+        func.count(Assignment.assignment_id)
+    ).filter(Assignment.event_id.in_(event_ids)).group_by(Assignment.event_id):
+        # Rows of a packed event are already counted in its pair_count
+        counts.setdefault(event_id, count)
+
+    return counts
+
+
+class RowStore:
+    """Repair access to an event stored as one Assignment row per pair"""
+
+    def __init__(self, event_id):
+        self.event_id = event_id
+
+    def has_giver(self, giver_id):
+        return Assignment.query.filter_by(event_id=self.event_id, giver_id=giver_id).first() is not None
+
+    def slot_size(self):
+        return Assignment.query.filter_by(event_id=self.event_id, slot=0).count()
+
+    def _locked(self):
+        """Assignment query for rows a repair may change: locked, and read as last committed"""
+        return Assignment.query.with_for_update().populate_existing()
+
+    def by_giver(self, giver_id):
+        return {a.slot: a for a in self._locked().filter_by(event_id=self.event_id, giver_id=giver_id)}
+
+    def by_receiver(self, receiver_id):
+        return {a.slot: a for a in self._locked().filter_by(event_id=self.event_id, receiver_id=receiver_id)}
+
+    def touching(self, participant_ids):
+        """Every row given or received by participant_ids, in one query"""
+        participant_ids = list(participant_ids)
+        return self._locked().filter(
+            Assignment.event_id == self.event_id,
+            Assignment.giver_id.in_(participant_ids) | Assignment.receiver_id.in_(participant_ids)
+        ).all()
+
+    def sample_pending(self, rng, avoid_ids, slot=0, count=32):
+        """
+        Sample pending assignments without scanning the event: jump to a random
+        assignment_id and take the next pending row via the primary key index.
+        """
+        low, high = db.session.query(
+            db.func.min(Assignment.assignment_id),
+            db.func.max(Assignment.assignment_id)
+        ).filter_by(event_id=self.event_id).one()
+
+        if low is None:
+            return
+
+        for _ in range(count):
+            candidate = self._locked().filter(
+                Assignment.event_id == self.event_id,
+                Assignment.slot == slot,
+                Assignment.gift_status == 'pending',
+                Assignment.assignment_id >= rng.randint(low, high),
+                Assignment.giver_id.notin_(avoid_ids),
+                Assignment.receiver_id.notin_(avoid_ids)
+            ).order_by(Assignment.assignment_id).first()
+
+            if candidate:
+                yield candidate
+
+    def receivers_by_giver(self, giver_ids):
+        """Every receiver (all slots) of the given givers as giver -> {receivers}"""
+        taken = {giver_id: set() for giver_id in giver_ids}
+        for giver_id, receiver_id in db.session.query(
+            Assignment.giver_id,
+            Assignment.receiver_id
+        ).filter(Assignment.event_id == self.event_id, Assignment.giver_id.in_(list(giver_ids))):
+            taken[giver_id].add(receiver_id)
+        return taken
+
+    def set_receiver(self, pair, receiver_id, score):
+        moved = pair.receiver_id != receiver_id
+        pair.receiver_id = receiver_id
+        pair.compatibility_score = score
+        if moved:
+            # One receiver change per UPDATE, in the caller's order, so
+            # unique_receiver_slot holds after every statement
+            db.session.flush()
+
+    def add(self, giver_id, receiver_id, slot, score):
+        db.session.add(Assignment(
+            event_id=self.event_id,
+            giver_id=giver_id,
+            receiver_id=receiver_id,
+            slot=slot,
+            compatibility_score=score
+        ))
+
+    def remove(self, pair):
+        db.session.delete(pair)
+        # Free the receiver before anyone else takes them
+        db.session.flush()
+
+    def save(self):
+        pass
+
+
+class PackedStore:
+    """Repair access to a packed event; changes are written back by save()"""
+
+    def __init__(self, event_id, row):
+        self.event_id = event_id
+        self.row = row
+        self.packed = PackedAssignments.from_row(row)
+        # Pairs with a row have left 'pending' (or are about to); repairs skip them
+        self.rows = {
+            (a.slot, a.giver_id): a
+            for a in Assignment.query.filter_by(event_id=event_id)
+        }
+
+    def _pair(self, slot, giver_id):
+        key = (slot, giver_id)
+        if key in self.rows:
+            return self.rows[key]
+        receiver_id = self.packed.receiver_of(giver_id, slot)
+        if receiver_id is None:
+            return None
+        return PackedPair(self.event_id, giver_id, receiver_id, slot, self.packed.score_of(giver_id, slot))
+
+    def has_giver(self, giver_id):
+        return any(self.packed.receiver_of(giver_id, slot) for slot in range(self.packed.slots))
+
+    def slot_size(self):
+        return sum(1 for receiver_id in self.packed.receivers[:self.packed.span] if receiver_id)
+
+    def by_giver(self, giver_id):
+        pairs = {slot: self._pair(slot, giver_id) for slot in range(self.packed.slots)}
+        return {slot: pair for slot, pair in pairs.items() if pair is not None}
+
+    def by_receiver(self, receiver_id):
+        pairs = {}
+        for slot in range(self.packed.slots):
+            giver_id = self.packed.giver_of(receiver_id, slot)
+            if giver_id is not None:
+                pairs[slot] = self._pair(slot, giver_id)
+        return pairs
+
+    def touching(self, participant_ids):
+        """Every pair given or received by participant_ids"""
+        pairs = {}
+        for pid in participant_ids:
+            for pair in list(self.by_giver(pid).values()) + list(self.by_receiver(pid).values()):
+                pairs[(pair.slot, pair.giver_id)] = pair
+        return list(pairs.values())
+
+    def sample_pending(self, rng, avoid_ids, slot=0, count=32):
+        """Random pending pairs of a slot, straight from the packed array"""
+        avoid_ids = set(avoid_ids)
+        for _ in range(count):
+            giver_id = self.packed.base_id + rng.randrange(self.packed.span)
+            receiver_id = self.packed.receiver_of(giver_id, slot)
+            if receiver_id is None or (slot, giver_id) in self.rows:
+                continue
+            if giver_id in avoid_ids or receiver_id in avoid_ids:
+                continue
+            yield self._pair(slot, giver_id)
+
+    def receivers_by_giver(self, giver_ids):
+        return {
+            giver_id: {
+                receiver_id
+                for receiver_id in (self.packed.receiver_of(giver_id, slot) for slot in range(self.packed.slots))
+                if receiver_id is not None
+            }
+            for giver_id in giver_ids
+        }
+
+    def set_receiver(self, pair, receiver_id, score):
+        self.packed.set_pair(pair.slot, pair.giver_id, receiver_id, score)
+        pair.receiver_id = receiver_id
+        pair.compatibility_score = score
+
+    def add(self, giver_id, receiver_id, slot, score):
+        self.packed.set_pair(slot, giver_id, receiver_id, score)
+
+    def remove(self, pair):
+        self.packed.remove_giver(pair.slot, pair.giver_id)
+
+    def save(self):
+        self.packed.to_row(self.row)
+
+
+def repair_store(event_id):
+    """
+    RowStore or PackedStore, whichever layout the event uses. Locks the
+    event row first (SELECT ... FOR UPDATE where the database has it), so
+    two repairs of one event cannot both plan from the same pending pairs;
+    the lock is held until the caller commits or rolls back.
+    """
+    db.session.query(Event.event_id).filter_by(event_id=event_id).with_for_update().first()
+    # A locking read sees the latest committed set, not the transaction's snapshot
+    row = AssignmentSet.query.filter_by(event_id=event_id).with_for_update().populate_existing().first()
+    return PackedStore(event_id, row) if row else RowStore(event_id)
@@ -0,0 +1,102 @@
+"""
+Wishlist compatibility scoring
+
+A giver -> receiver score is built from the receiver's wishlist:
+
+* 0.5 base (also the score when the receiver has no wishlist)
+* up to 0.2 for how complete the receiver's wishlist is
+* up to 0.2 for hobby tags shared with the giver (Jaccard overlap)
+* 0.1 when giver and receiver picked the same gift category
+
+``score_pair`` and ``compatibility_matrix`` compute the same numbers; the
+matrix version scores every pair at once with NumPy.
+"""
+
+BASE_SCORE = 0.5
+COMPLETENESS_WEIGHT = 0.2
+SHARED_TAGS_WEIGHT = 0.2
+CATEGORY_WEIGHT = 0.1
+
+WISHLIST_FIELDS = ('preferences', 'gift_category', 'clothing_size', 'color_preference', 'hobby_tags')
+
+
+def wishlist_features(wishlist):
+    """Return (tags, category, completeness) for a wishlist, or None"""
+    if wishlist is None:
+        return None
+
+    tags = frozenset(
+        tag.strip().lower()
+        for tag in (wishlist.hobby_tags or '').split(',')
+        if tag.strip()
+    )
+    category = (wishlist.gift_category or '').strip().lower() or None
+    filled = sum(1 for field in WISHLIST_FIELDS if (getattr(wishlist, field) or '').strip())
+
+    return tags, category, filled / len(WISHLIST_FIELDS)
+
+
+def score_pair(giver_features, receiver_features):
+    """Score one giver -> receiver pair from wishlist_features() tuples"""
+    if receiver_features is None:
+        return BASE_SCORE
+
+    receiver_tags, receiver_category, completeness = receiver_features
+    score = BASE_SCORE + COMPLETENESS_WEIGHT * completeness
+
+    if giver_features is not None:
+        giver_tags, giver_category, _ = giver_features
+        union = giver_tags | receiver_tags
+        if union:
+            score += SHARED_TAGS_WEIGHT * len(giver_tags & receiver_tags) / len(union)
+        if receiver_category and giver_category == receiver_category:
+            score += CATEGORY_WEIGHT
+
+    return min(score, 1.0)
+
+
+def compatibility_matrix(features):
+    """
+    Score every pair in one vectorized pass.
+
+    ``features`` is a list of wishlist_features() results (one per
+    participant, None when there is no wishlist). Returns an N x N float32
+    array where [i, j] scores participant i giving to participant j.
+    """
+    import numpy as np
+
+    n = len(features)
+    has_wishlist = np.array([f is not None for f in features], dtype=bool)
+
+    tag_index = {}
+    category_index = {}
+    tag_rows, tag_cols = [], []
+    categories = np.full(n, -1, dtype=np.int32)
+    completeness = np.zeros(n, dtype=np.float32)
+
+    for i, f in enumerate(features):
+        if f is None:
+            continue
+        tags, category, filled = f
+        for tag in tags:
+            tag_rows.append(i)
+            tag_cols.append(tag_index.setdefault(tag, len(tag_index)))
+        if category:
+            categories[i] = category_index.setdefault(category, len(category_index))
+        completeness[i] = filled
+
+    tag_matrix = np.zeros((n, max(len(tag_index), 1)), dtype=np.float32)
+    tag_matrix[tag_rows, tag_cols] = 1.0
+
+    shared = tag_matrix @ tag_matrix.T
+    tag_counts = tag_matrix.sum(axis=1)
+    union = tag_counts[:, None] + tag_counts[None, :] - shared
+    jaccard = np.divide(shared, union, out=np.zeros_like(shared), where=union > 0)
+
+    same_category = (categories[:, None] == categories[None, :]) & (categories[None, :] >= 0)
+
+    scores = BASE_SCORE + COMPLETENESS_WEIGHT * completeness[None, :]
+    scores = scores + SHARED_TAGS_WEIGHT * jaccard + CATEGORY_WEIGHT * same_category
+    scores = np.where(has_wishlist[None, :], scores, BASE_SCORE)
+
+    return np.minimum(scores, 1.0).astype(np.float32)
@@ -1,61 +1,262 @@
 """
 Email notification service
 """
-from flask import render_template, current_app, has_request_context, url_for
+from flask import render_template, current_app, has_request_context, request, url_for
 from flask_mail import Message
-from app import mail
-from threading import Thread
+from markupsafe import escape
+from app import db, mail
+from app.utils.scheduler import Debouncer
+import json
+import re
+import smtplib
 
-def send_async_email(app, msg):
-    """Send email asynchronously"""
-    with app.app_context():
-        try:
-            mail.send(msg)
-        except Exception as e:
-            print(f"Error sending email: {str(e)}")
+class SMTPUnavailable(Exception):
+    """The server could not be reached or refused our login or sender: no message can go out"""
+    
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
 
-def send_email(subject, recipients, template, **kwargs):
-    """Send email to recipients"""
-    if not recipients:
-        return False
+def send_batch(messages, on_error=None):
+    """
+    Send many messages over as few SMTP connections as possible, returning
+    (sent, failed). One connection (handshake, TLS, login) carries up to
+    MAIL_BATCH_SIZE messages before it is recycled; a dropped connection is
+    reopened and the message retried, up to MAIL_SEND_ATTEMPTS times. When
+    connecting, logging in or MAIL FROM fails, the batch stops: that message
+    and every later one fail with SMTPUnavailable.
+    `messages` may be a generator so they are built one at a time.
+    on_error(msg, exception) is called for every message that was not sent.
+    """
+    config = current_app.config
+    batch_size = max(1, config.get('MAIL_BATCH_SIZE', 200))
+    attempts = max(1, config.get('MAIL_SEND_ATTEMPTS', 3))
+    
+    connection = None
+    in_batch = 0
+    sent = failed = 0
+    unavailable = None
+    
+    for msg in messages:
+        # Once the server is unavailable the rest of the batch fails without trying
+        error = unavailable
+        for attempt in range(attempts if unavailable is None else 0):
+            if connection is not None and in_batch >= batch_size:
+                _close_connection(connection)
+                connection = None
+            if connection is None:
+                try:
+                    connection = mail.connect().__enter__()
+                except Exception as e:
+                    # Unreachable server, failed TLS or login (a rotated password): stop the batch
+                    error = unavailable = SMTPUnavailable(e)
+                    break
+                in_batch = 0
+            
+            try:
+                connection.send(msg)
+                in_batch += 1
+                error = None
+                break
+            except smtplib.SMTPSenderRefused as e:
+                # MAIL FROM refused: a problem with our account, not with this message
+                error = unavailable = SMTPUnavailable(e)
+                break
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+                # The server rejected this message; the connection is still good
+                error = e
+                break
+            except OSError as e:
+                # Dropped connection: start a fresh one and retry
+                error = e
+                _close_connection(connection)
+                connection = None
+            except Exception as e:
+                error = e
+                break
+        
+        if error is None:
+            sent += 1
+        else:
+            failed += 1
+            if not isinstance(error, SMTPUnavailable):
+                print(f"Error sending email: {str(error)}")
+            if on_error:
+                on_error(msg, error)
+    
+    if connection is not None:
+        _close_connection(connection)
+    if unavailable is not None:
+        print(f"Error sending email: server unavailable, {failed} messages not sent: {str(unavailable)}")
+    
+    return sent, failed
+
+def _close_connection(connection):
+    """QUIT an SMTP connection, or just drop the socket if it is already dead"""
+    try:
+        connection.__exit__(None, None, None)
+    except Exception:
+        if connection.host:
+            connection.host.close()
+
+def _url_for_external(endpoint, **values):
+    """url_for for email templates: absolute links"""
+    values.setdefault('_external', True)
+    return url_for(endpoint, **values)
+
+def email_base_url():
+    """Base URL for links in an email queued now, to render it with later"""
+    if has_request_context():
+        return request.host_url
+    return current_app.config.get('APP_BASE_URL')
+
+def render_email(template, base_url=None, **kwargs):
+    """
+    Render emails/<template>.html. Outside a request (mail workers, digests,
+    the CLI) links are built against base_url, or APP_BASE_URL when not given.
+    """
+    # Add url_for helper to template context
+    kwargs['url_for'] = _url_for_external
+    if has_request_context() and base_url is None:
+        return render_template(f'emails/{template}.html', **kwargs)
+    
+    with current_app.test_request_context(base_url=base_url or current_app.config.get('APP_BASE_URL')):
+        return render_template(f'emails/{template}.html', **kwargs)
+
+class SkeletonError(Exception):
+    """The template does more with a per-recipient value than print it"""
+
+class _Field:
+    """Stands in for a per-recipient value while a skeleton renders"""
+    
+    def __init__(self, skeleton, path):
+        self._skeleton = skeleton
+        self._path = path
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return _Field(self._skeleton, self._path + (name,))
+    
+    def __html__(self):
+        return self._skeleton._marker(self._path)
+    
+    __str__ = __html__
+    
+    def _branch(self, *args):
+        raise SkeletonError(f"template depends on {'.'.join(self._path)}")
+    
+    __bool__ = __len__ = __iter__ = __eq__ = __ne__ = __lt__ = __gt__ = __getitem__ = __call__ = _branch
+    __hash__ = None
+
+class EmailSkeleton:
+    """
+    One email template rendered once for a whole fan-out. The names in
+    `per_recipient` render as markers; the output is split on them into
+    static parts and attribute paths, so render() per recipient is a join
+    of escaped values instead of a Jinja render. A template that branches
+    on, filters or compares a per-recipient value cannot be split like this
+    and is rendered normally for every recipient instead. The other keyword
+    arguments are shared by all recipients and go to render_email as they
+    are (base_url included).
+    """
+    
+    _MARKER = re.compile(r'\x00sKeL(\d+)\x00')
     
+    def __init__(self, template, per_recipient, **shared):
+        self.template = template
+        self.shared = shared
+        self._paths = []
+        self._parts = None
+        
+        try:
+            html = render_email(template, **shared, **{name: _Field(self, (name,)) for name in per_recipient})
+        except SkeletonError:
+            return
+        
+        pieces = self._MARKER.split(html)
+        static = pieces[0::2]
+        if any('\x00' in part for part in static):
+            # A filter changed a marker (|title, |truncate, ...)
+            return
+        self._parts = static
+        self._holes = [self._paths[int(index)] for index in pieces[1::2]]
+    
+    def _marker(self, path):
+        self._paths.append(path)
+        return f'\x00sKeL{len(self._paths) - 1}\x00'
+    
+    @property
+    def precompiled(self):
+        """False when every recipient falls back to a full render"""
+        return self._parts is not None
+    
+    def render(self, **recipient):
+        """HTML for one recipient, given the per_recipient values"""
+        if self._parts is None:
+            return render_email(self.template, **self.shared, **recipient)
+        
+        out = [self._parts[0]]
+        for path, part in zip(self._holes, self._parts[1:]):
+            out.append(escape(_resolve(recipient[path[0]], path[1:])))
+            out.append(part)
+        return ''.join(out)
+
+def _resolve(value, names):
+    """Follow attributes the way Jinja does, printing missing ones as ''"""
+    for name in names:
+        try:
+            value = getattr(value, name)
+        except AttributeError:
+            try:
+                value = value[name]
+            except (TypeError, LookupError):
+                return ''
+    return value
+
+def email_sender():
+    """From address for every notification"""
+    return current_app.config.get('MAIL_USERNAME') or 'noreply@secretsanta.com'
+
+def build_email(subject, recipients, template, **kwargs):
+    """Render a template into a Flask-Mail Message"""
     # Ensure recipients is a list
     if isinstance(recipients, str):
         recipients = [recipients]
     
-    try:
-        with current_app.app_context():
-            # Add url_for helper to template context
-            # Safe helper: when there's no active request (e.g. test scripts),
-            # just return "#" instead of failing on URL building.
-            def url_for_external(endpoint, **values):
-                if not has_request_context():
-                    return "#"
-                values.setdefault('_external', True)
-                return url_for(endpoint, **values)
-
-            kwargs['url_for'] = url_for_external
-            
-            msg = Message(
-                subject=subject,
-                recipients=recipients,
-                html=render_template(f'emails/{template}.html', **kwargs),
-                sender=current_app.config.get('MAIL_USERNAME') or 'noreply@secretsanta.com'
-            )
-        
-        # Send email asynchronously
-        Thread(target=send_async_email, args=(current_app._get_current_object(), msg)).start()
-        return True
-    except Exception as e:
-        print(f"Error preparing email: {str(e)}")
+    return Message(
+        subject=subject,
+        recipients=recipients,
+        html=render_email(template, **kwargs),
+        sender=email_sender()
+    )
+
+def queue_email(subject, recipients, template, **kwargs):
+    """
+    Render an email into the outbox in the current transaction. Nothing is
+    committed here: it goes out once (and only if) the caller commits.
+    """
+    from app.models import EmailOutbox
+    from app.utils.outbox import notify_on_commit
+    
+    if not recipients:
         return False
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    
+    html = render_email(template, **kwargs)
+    for recipient in recipients:
+        db.session.add(EmailOutbox(recipient=recipient, subject=subject, html=html))
+    
+    notify_on_commit()
+    return True
 
 def send_event_created_email(event, creator):
-    """Send email when event is created"""
+    """Queue email when event is created (sent when the caller commits)"""
     subject = f"🎁 Secret Santa Event Created: {event.event_name}"
     recipients = [creator.email]
     
-    send_email(
+    queue_email(
         subject=subject,
         recipients=recipients,
         template='event_created',
@@ -64,11 +265,11 @@ def send_event_created_email(event, creator):
     )
 
 def send_assignment_email(assignment, giver, receiver, event):
-    """Send email when assignment is generated"""
+    """Queue email when assignment is generated (sent when the caller commits)"""
     subject = f"🎁 Your Secret Santa Assignment for {event.event_name}"
     recipients = [giver.email]
     
-    send_email(
+    queue_email(
         subject=subject,
         recipients=recipients,
         template='assignment_notification',
@@ -78,27 +279,96 @@ def send_assignment_email(assignment, giver, receiver, event):
         event=event
     )
 
+def send_assignment_emails(event):
+    """
+    Tell every giver of an event who they give to. Like the status fan-out,
+    only one outbox row is written in the caller's transaction; the outbox
+    worker resolves all givers and receivers in one query and writes one
+    email per pair, with links built against the request's base URL.
+    """
+    from app.models import EmailOutbox
+    from app.utils.outbox import notify_on_commit
+    
+    db.session.add(EmailOutbox(
+        kind='assignments',
+        subject=f"🎁 Your Secret Santa Assignment for {event.event_name}",
+        payload=json.dumps({'event_id': event.event_id, 'base_url': email_base_url()})
+    ))
+    notify_on_commit()
+    return True
+
 def send_new_message_email(message, receiver, sender_name, event):
-    """Send email when new message is received"""
-    subject = f"💬 New Anonymous Message - {event.event_name}"
-    recipients = [receiver.email]
+    """
+    Schedule the notification for a committed message. Messages a receiver
+    gets within MESSAGE_DIGEST_WINDOW seconds of the first one are sent as
+    one digest email at the end of that window, with links built against
+    the base URL of the request that sent the latest message.
+    """
+    _message_digests.add(receiver.user_id, (message.message_id, email_base_url()))
+
+def send_message_digest(receiver_id, items):
+    """Digest callback: one email for the receiver's messages (of (message_id, base_url) items) that are still unread"""
+    from app.models import Message, User
+    from sqlalchemy.orm import joinedload
     
-    send_email(
-        subject=subject,
-        recipients=recipients,
-        template='new_message',
-        message=message,
-        receiver=receiver,
-        sender_name=sender_name,
-        event=event
-    )
+    message_ids = [message_id for message_id, _ in items]
+    base_url = items[-1][1]
+    
+    receiver = User.query.get(receiver_id)
+    if not receiver:
+        return
+    
+    messages = Message.query.options(joinedload(Message.event)).filter(
+        Message.message_id.in_(message_ids),
+        Message.receiver_id == receiver_id,
+        Message.is_read == False
+    ).order_by(Message.created_at, Message.message_id).all()
+    if not messages:
+        return
+    
+    if len(messages) == 1:
+        message = messages[0]
+        queue_email(
+            subject=f"💬 New Anonymous Message - {message.event.event_name}",
+            recipients=[receiver.email],
+            template='new_message',
+            base_url=base_url,
+            message=message,
+            receiver=receiver,
+            sender_name="Anonymous",
+            event=message.event
+        )
+    else:
+        conversations = {}
+        for message in messages:
+            conversations.setdefault(message.event, []).append(message)
+        
+        if len(conversations) == 1:
+            subject = f"💬 {len(messages)} New Anonymous Messages - {messages[0].event.event_name}"
+        else:
+            subject = f"💬 {len(messages)} New Anonymous Messages"
+        
+        queue_email(
+            subject=subject,
+            recipients=[receiver.email],
+            template='message_digest',
+            base_url=base_url,
+            receiver=receiver,
+            count=len(messages),
+            conversations=list(conversations.items())
+        )
+    
+    db.session.commit()
+
+# Fixed window per receiver (max_wait_ratio=1): later messages never push the email back
+_message_digests = Debouncer(send_message_digest, 'MESSAGE_DIGEST_WINDOW', default_delay=300.0, max_wait_ratio=1)
 
 def send_deadline_reminder_email(event, participant):
-    """Send email reminder for gift deadline"""
+    """Queue email reminder for gift deadline (sent when the caller commits)"""
     subject = f"⏰ Gift Deadline Reminder - {event.event_name}"
     recipients = [participant.user.email]
     
-    send_email(
+    queue_email(
         subject=subject,
         recipients=recipients,
         template='deadline_reminder',
@@ -107,11 +377,11 @@ def send_deadline_reminder_email(event, participant):
     )
 
 def send_event_status_email(event, participant, status):
-    """Send email when event status changes"""
+    """Queue email when event status changes (sent when the caller commits)"""
     subject = f"📢 Event Update: {event.event_name} - {status.title()}"
     recipients = [participant.user.email]
     
-    send_email(
+    queue_email(
         subject=subject,
         recipients=recipients,
         template='event_status',
@@ -120,16 +390,42 @@ def send_event_status_email(event, participant, status):
         status=status
     )
 
-def send_participant_joined_email(event, new_participant, admin):
-    """Send email to admin when new participant joins"""
+def send_event_status_emails(event, status):
+    """
+    Tell every active participant about a status change. Only one fan-out
+    row is written in the caller's transaction; the outbox worker expands it
+    into one email per participant from a single EmailSkeleton render, so a
+    big event costs the request a single insert and the worker one render.
+    The request's base URL travels in the payload for the event links.
+    """
+    from app.models import EmailOutbox
+    from app.utils.outbox import notify_on_commit
+    
+    db.session.add(EmailOutbox(
+        kind='event_status',
+        subject=f"📢 Event Update: {event.event_name} - {status.title()}",
+        payload=json.dumps({'event_id': event.event_id, 'status': status, 'base_url': email_base_url()})
+    ))
+    notify_on_commit()
+    return True
+
+def send_participant_joined_email(event, new_participant, admin, assignment_error=None):
+    """
+    Queue email to admin when new participant joins (sent when the caller
+    commits). assignment_error says why a late joiner could not be spliced
+    into the existing assignments; the email then asks for a reshuffle.
+    """
     subject = f"👤 New Participant Joined: {event.event_name}"
+    if assignment_error:
+        subject = f"⚠️ Reshuffle Needed: {event.event_name}"
     recipients = [admin.email]
     
-    send_email(
+    queue_email(
         subject=subject,
         recipients=recipients,
         template='participant_joined',
         event=event,
         new_participant=new_participant,
-        admin=admin
+        admin=admin,
+        assignment_error=assignment_error
     )
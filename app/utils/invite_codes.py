@@ -0,0 +1,129 @@
+"""
+Invite codes without collisions
+
+Codes are 8 characters from the same alphabet as before (A-Z, 0-9), but
+instead of drawing random codes and querying until one is unused, every
+event takes the next number of a sequence and a keyed Feistel permutation of
+[0, 36^8) turns it into a code. Distinct numbers always give distinct codes,
+and without the key the codes look random and cannot be enumerated.
+
+The sequence is allocated in blocks (hi/lo): a process reserves
+BLOCK_SIZE numbers by inserting one InviteCodeBlock row, whose
+auto-increment id no other process can get, and hands them out from memory.
+Creating an event therefore needs no extra query; numbers of a block left
+unused when a process exits are simply skipped.
+
+The key comes from INVITE_CODE_KEY (SECRET_KEY when unset) and must never
+change once codes exist: another key is another permutation, whose codes
+can collide with the old ones. Random codes of events created before this
+are not part of the permutation either; a clash with one of them is as
+unlikely as two random codes clashing was, and the unique index still
+rejects it.
+"""
+from flask import current_app
+from app import db
+from app.models import InviteCodeBlock
+from datetime import datetime
+import hashlib
+import string
+import threading
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 8
+DOMAIN = len(ALPHABET) ** CODE_LENGTH
+
+# Balanced Feistel network on the smallest even bit width covering DOMAIN;
+# values that land outside DOMAIN are walked through the network again
+HALF_BITS = ((DOMAIN - 1).bit_length() + 1) // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 6
+
+# Sequence numbers per reserved block; block n covers [n * BLOCK_SIZE, (n + 1) * BLOCK_SIZE),
+# so this can never change once blocks exist
+BLOCK_SIZE = 1000
+
+
+class FeistelPermutation:
+    """Keyed bijection on [0, DOMAIN)"""
+
+    def __init__(self, key):
+        if isinstance(key, str):
+            key = key.encode()
+        self.key = hashlib.sha256(key).digest()
+
+    def _round(self, index, value):
+        digest = hashlib.blake2b(
+            value.to_bytes(8, 'big') + bytes([index]),
+            key=self.key,
+            digest_size=8
+        ).digest()
+        return int.from_bytes(digest, 'big') & HALF_MASK
+
+    def _encrypt(self, value):
+        left, right = value >> HALF_BITS, value & HALF_MASK
+        for index in range(ROUNDS):
+            left, right = right, left ^ self._round(index, right)
+        return (left << HALF_BITS) | right
+
+    def permute(self, number):
+        """Image of number in [0, DOMAIN); cycle-walking keeps it a bijection"""
+        if not 0 <= number < DOMAIN:
+            raise ValueError('invite code sequence exhausted')
+        value = self._encrypt(number)
+        while value >= DOMAIN:
+            value = self._encrypt(value)
+        return value
+
+
+def encode(value):
+    """Fixed-length code for a number in [0, DOMAIN)"""
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+class InviteCodeSequence:
+    """Hands out sequence numbers from blocks reserved in the database"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._permutation = None
+        self._key = None
+
+    def _reserve_block(self):
+        # Own transaction: the block stays reserved even if the event insert rolls back
+        with db.engine.begin() as connection:
+            result = connection.execute(
+                InviteCodeBlock.__table__.insert().values(reserved_at=datetime.utcnow())
+            )
+            block_id = result.inserted_primary_key[0]
+        return block_id * BLOCK_SIZE, (block_id + 1) * BLOCK_SIZE
+
+    def next_code(self):
+        """A code no other event has been or will be given under the same key"""
+        config = current_app.config
+        key = config.get('INVITE_CODE_KEY') or config['SECRET_KEY']
+
+        with self._lock:
+            if self._key != key:
+                self._permutation = FeistelPermutation(key)
+                self._key = key
+            if self._next >= self._end:
+                self._next, self._end = self._reserve_block()
+            number = self._next
+            self._next += 1
+            permutation = self._permutation
+
+        return encode(permutation.permute(number))
+
+
+_sequence = InviteCodeSequence()
+
+
+def next_invite_code():
+    """Invite code for a new event, unique by construction"""
+    return _sequence.next_code()
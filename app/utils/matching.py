@@ -0,0 +1,301 @@
+"""
+Pairing algorithms used by the assignment engine
+
+These helpers work on plain participant ids so they can run without a
+database session (and in worker processes).
+"""
+import random
+
+
+def sattolo_cycle(ids, rng=None):
+    """Return receivers for ids as one random cycle (no fixed points) in O(N)"""
+    rng = rng or random.Random()
+    receivers = list(ids)
+
+    # Sattolo's shuffle only produces single-cycle permutations, so
+    # position i never keeps its own id and nobody draws themselves.
+    for i in range(len(receivers) - 1, 0, -1):
+        j = rng.randrange(i)
+        receivers[i], receivers[j] = receivers[j], receivers[i]
+
+    return receivers
+
+
+def random_derangement(ids, rng=None):
+    """Return receivers for ids as a uniformly random derangement in expected O(N)"""
+    rng = rng or random.Random()
+    receivers = list(ids)
+    if len(receivers) < 2:
+        return receivers
+
+    # About 1/e of all permutations have no fixed point, so a fresh
+    # Fisher-Yates shuffle is kept after e (~2.7) tries on average, at any N.
+    # Every derangement is equally likely, unlike Sattolo's single cycles.
+    while True:
+        rng.shuffle(receivers)
+        if all(giver_id != receiver_id for giver_id, receiver_id in zip(ids, receivers)):
+            return receivers
+
+
+def is_allowed(giver_id, receiver_id, forbidden):
+    """Check a single giver -> receiver pair against self and exclusions"""
+    return giver_id != receiver_id and receiver_id not in forbidden.get(giver_id, ())
+
+
+def merge_forbidden(*maps):
+    """Combine several giver -> {receivers} maps into a new one"""
+    merged = {}
+    for forbidden in maps:
+        for giver_id, receiver_ids in forbidden.items():
+            merged.setdefault(giver_id, set()).update(receiver_ids)
+    return merged
+
+
+def find_assignment(ids, forbidden, rng=None, greedy_tries=8, single_cycle=False):
+    """
+    Find a derangement of ids that avoids every forbidden pair.
+
+    ``forbidden`` maps giver_id -> set of receiver_ids. Starts from a uniform
+    random derangement (one Sattolo cycle with ``single_cycle``, which leaves
+    ring mode fewer cycles to join), drops the forbidden edges and re-matches
+    the givers left over with augmenting paths (bipartite matching on the
+    allowed graph).
+    Each search costs O(N + exclusions), so dense rule sets never stall the
+    way random retries do.
+
+    Returns ``(assignment_map, None)`` on success or ``(None, blocked)``
+    where ``blocked`` is a ``(givers, receivers)`` tuple: a group of givers
+    whose only allowed receivers are the smaller ``receivers`` set.
+    """
+    rng = rng or random.Random()
+    ids = list(ids)
+    receivers = sattolo_cycle(ids, rng) if single_cycle else random_derangement(ids, rng)
+
+    match_of_giver = {}
+    match_of_receiver = {}
+    unmatched = []
+    for giver_id, receiver_id in zip(ids, receivers):
+        if is_allowed(giver_id, receiver_id, forbidden):
+            match_of_giver[giver_id] = receiver_id
+            match_of_receiver[receiver_id] = giver_id
+        else:
+            unmatched.append(giver_id)
+
+    # Cheap greedy pass first: most leftovers can take some free receiver
+    # directly, so only the hard cases pay for a full augmenting search.
+    free_receivers = [r for r in ids if r not in match_of_receiver]
+    rng.shuffle(free_receivers)
+    still_unmatched = []
+    for giver_id in unmatched:
+        for _ in range(greedy_tries):
+            if not free_receivers:
+                break
+            k = rng.randrange(len(free_receivers))
+            receiver_id = free_receivers[k]
+            if is_allowed(giver_id, receiver_id, forbidden):
+                free_receivers[k] = free_receivers[-1]
+                free_receivers.pop()
+                match_of_giver[giver_id] = receiver_id
+                match_of_receiver[receiver_id] = giver_id
+                break
+        if giver_id not in match_of_giver:
+            still_unmatched.append(giver_id)
+
+    rng.shuffle(still_unmatched)
+    for giver_id in still_unmatched:
+        blocked = _augment(giver_id, ids, forbidden, match_of_giver, match_of_receiver, rng)
+        if blocked:
+            return None, blocked
+
+    return match_of_giver, None
+
+
+def disjoint_assignments(ids, k, forbidden, rng=None):
+    """
+    k mutually disjoint derangements of ids that avoid every forbidden pair.
+
+    Each slot is one find_assignment() call with the pairs of the earlier
+    slots added to ``forbidden``, so the slots are drawn independently:
+    knowing who someone's receivers give to says nothing about the giver's
+    other receivers. (Shifts of one shuffled circle would be cheaper, but
+    shifts commute: the slot-1 receiver of a giver's slot-0 receiver is
+    always the slot-0 receiver of their slot-1 receiver.) Returns ``(slot_maps, None)``, or ``(None,
+    blocked)`` when a slot cannot be filled. ``blocked`` is the Hall violator
+    for the first slot and None for later ones, whose shortage comes from the
+    earlier slots rather than from the rules.
+    """
+    rng = rng or random.Random()
+
+    slot_maps = []
+    taken = {}
+    for slot in range(k):
+        slot_forbidden = merge_forbidden(forbidden, taken) if taken else forbidden
+        assignment_map, blocked = find_assignment(ids, slot_forbidden, rng)
+        if assignment_map is None:
+            return None, (blocked if slot == 0 else None)
+
+        slot_maps.append(assignment_map)
+        for giver_id, receiver_id in assignment_map.items():
+            taken.setdefault(giver_id, set()).add(receiver_id)
+
+    return slot_maps, None
+
+
+def _augment(start_giver, ids, forbidden, match_of_giver, match_of_receiver, rng):
+    """Extend the matching by one giver via BFS; return the Hall violator on failure"""
+    unvisited = list(ids)
+    rng.shuffle(unvisited)
+
+    parent_of_receiver = {}
+    visited_givers = [start_giver]
+    queue = [start_giver]
+
+    while queue:
+        giver_id = queue.pop()
+        excluded = forbidden.get(giver_id, ())
+
+        # Each pass costs (receivers reached) + (receivers this giver excludes),
+        # which keeps a whole search at O(N + exclusions).
+        still_unvisited = []
+        for receiver_id in unvisited:
+            if receiver_id == giver_id or receiver_id in excluded:
+                still_unvisited.append(receiver_id)
+                continue
+
+            parent_of_receiver[receiver_id] = giver_id
+            next_giver = match_of_receiver.get(receiver_id)
+            if next_giver is None:
+                _flip_path(receiver_id, parent_of_receiver, match_of_giver, match_of_receiver)
+                return None
+
+            visited_givers.append(next_giver)
+            queue.append(next_giver)
+        unvisited = still_unvisited
+
+    return visited_givers, list(parent_of_receiver)
+
+
+def _flip_path(receiver_id, parent_of_receiver, match_of_giver, match_of_receiver):
+    """Apply an augmenting path ending at a free receiver"""
+    while receiver_id is not None:
+        giver_id = parent_of_receiver[receiver_id]
+        previous_receiver = match_of_giver.get(giver_id)
+        match_of_giver[giver_id] = receiver_id
+        match_of_receiver[receiver_id] = giver_id
+        receiver_id = previous_receiver
+
+
+def max_score_assignment(ids, scores, forbidden, rng=None):
+    """
+    Highest-total-score derangement of ids.
+
+    ``scores`` is an N x N array aligned with ids (see
+    compatibility.compatibility_matrix). Solves min-cost assignment on the
+    negated scores with the diagonal and forbidden pairs set to infinity.
+    Rows and columns are visited in a random order so that draws with equal
+    total score still vary between runs.
+
+    Returns the assignment map, or None when no valid assignment exists.
+    """
+    import numpy as np
+    from scipy.optimize import linear_sum_assignment
+
+    rng = rng or random.Random()
+    order = list(range(len(ids)))
+    rng.shuffle(order)
+    ids = [ids[i] for i in order]
+    scores = np.asarray(scores)[np.ix_(order, order)]
+
+    # Every assignment takes exactly one entry per column, so measuring cost
+    # from each column's best score keeps the optimum and makes it much
+    # cheaper to find than the raw negated scores.
+    cost = scores.max(axis=0)[None, :].astype(np.float64) - scores
+    np.fill_diagonal(cost, np.inf)
+
+    position = {pid: i for i, pid in enumerate(ids)}
+    for giver_id, receiver_ids in forbidden.items():
+        if giver_id not in position:
+            continue
+        columns = [position[r] for r in receiver_ids if r in position]
+        cost[position[giver_id], columns] = np.inf
+
+    try:
+        rows, cols = linear_sum_assignment(cost)
+    except ValueError:
+        return None
+
+    return {ids[i]: ids[j] for i, j in zip(rows, cols)}
+
+
+def cycle_lengths(assignment_map):
+    """Lengths of the gift chains (cycles) in an assignment map, in O(N)"""
+    lengths = []
+    seen = set()
+    for start in assignment_map:
+        if start in seen:
+            continue
+        length = 0
+        node = start
+        while node not in seen:
+            seen.add(node)
+            node = assignment_map[node]
+            length += 1
+        lengths.append(length)
+    return lengths
+
+
+def is_single_cycle(assignment_map):
+    """True when following receivers from anyone visits everyone once (one ring)"""
+    if not assignment_map:
+        return False
+    start = next(iter(assignment_map))
+    node = assignment_map[start]
+    steps = 1
+    while node != start and steps <= len(assignment_map):
+        node = assignment_map[node]
+        steps += 1
+    return node == start and steps == len(assignment_map)
+
+
+def join_cycles(assignment_map, forbidden, rng=None, tries=64):
+    """
+    Merge every cycle of a valid assignment into one ring, in place.
+
+    Swapping the receivers of a (in the ring) and b (in another cycle)
+    splices the two cycles together, so each merge costs O(1) and the whole
+    pass is O(N). A swap is only made when both new pairs are allowed.
+    Returns False if some cycle could not be joined.
+    """
+    rng = rng or random.Random()
+
+    cycles = []
+    seen = set()
+    for start in assignment_map:
+        if start in seen:
+            continue
+        cycle = []
+        node = start
+        while node not in seen:
+            seen.add(node)
+            cycle.append(node)
+            node = assignment_map[node]
+        cycles.append(cycle)
+
+    if len(cycles) <= 1:
+        return True
+
+    rng.shuffle(cycles)
+    ring = cycles[0]
+    for cycle in cycles[1:]:
+        for _ in range(tries):
+            a = rng.choice(ring)
+            b = rng.choice(cycle)
+            a_receiver, b_receiver = assignment_map[a], assignment_map[b]
+            if is_allowed(a, b_receiver, forbidden) and is_allowed(b, a_receiver, forbidden):
+                assignment_map[a], assignment_map[b] = b_receiver, a_receiver
+                ring.extend(cycle)
+                break
+        else:
+            return False
+
+    return True
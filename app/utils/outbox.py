@@ -0,0 +1,355 @@
+"""
+Durable email outbox
+
+Notifications are written to email_outbox in the same transaction as the
+change they report (email_service.queue_email), so an email exists exactly
+when that change committed and survives a crash or restart. Workers then
+drain the table:
+
+- claim_batch moves up to OUTBOX_BATCH_SIZE due rows to 'sending' under a
+  fresh claim token. Rows are picked with FOR UPDATE SKIP LOCKED where the
+  database has it, and the claim UPDATE only takes rows that are still
+  'pending', so any number of threads or processes can drain at once
+  without sending a row twice.
+- A failed row goes back to 'pending' with exponential backoff
+  (OUTBOX_BACKOFF_BASE doubling up to OUTBOX_BACKOFF_MAX seconds) and is
+  parked as 'dead' after OUTBOX_MAX_ATTEMPTS tries. A permanent rejection
+  (every recipient refused with 5xx, or 5xx after DATA) is parked as 'dead'
+  at once. When the server is unavailable (connect, login or MAIL FROM
+  failed) the batch stops and its rows back off without ever going dead.
+- A row left in 'sending' for OUTBOX_CLAIM_TIMEOUT seconds (its worker
+  died) is released again, so delivery is at least once.
+
+A fan-out row (kind 'event_status' or 'assignments', see FANOUTS) stands
+for one email per participant or pair; draining it writes those rows, so
+the request that triggered it only inserted one row however big the event
+is.
+
+Every web process runs OutboxWorker threads from startup (run.py), so
+rows left pending or backing off by an earlier run go out without waiting
+for new mail; it is also woken when a transaction that queued email
+commits. `flask drain-outbox` runs extra workers, or the only ones with
+OUTBOX_WORKER off.
+"""
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_mail import Message
+from sqlalchemy import event as sa_event, insert, update
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import EmailOutbox, Event, Participant, User
+from app.utils.assignment_store import event_pairs
+from app.utils.email_service import send_batch, email_sender, EmailSkeleton, SMTPUnavailable
+from datetime import datetime, timedelta
+import click
+import json
+import smtplib
+import threading
+import time
+import uuid
+
+
+def notify_on_commit():
+    """Wake this process's outbox worker once the current transaction commits"""
+    db.session.info['outbox_notify'] = True
+
+
+@sa_event.listens_for(db.session, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('outbox_notify', False):
+        outbox_worker.wake()
+
+
+@sa_event.listens_for(db.session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('outbox_notify', None)
+
+
+def claim_batch(limit=None):
+    """Claim due rows for this worker and return them (already committed as 'sending')"""
+    config = current_app.config
+    limit = limit or config.get('OUTBOX_BATCH_SIZE', 100)
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+
+    # Rows whose worker died mid-send
+    db.session.execute(
+        update(EmailOutbox)
+        .where(
+            EmailOutbox.status == 'sending',
+            EmailOutbox.claimed_at < now - timedelta(seconds=config.get('OUTBOX_CLAIM_TIMEOUT', 600))
+        )
+        .values(status='pending', claimed_by=None)
+    )
+
+    due = db.session.query(EmailOutbox.outbox_id).filter(
+        EmailOutbox.status == 'pending',
+        EmailOutbox.next_attempt_at <= now
+    ).order_by(EmailOutbox.next_attempt_at).limit(limit).with_for_update(skip_locked=True)
+    outbox_ids = [row.outbox_id for row in due]
+
+    if outbox_ids:
+        # Another worker may have taken some of them since the SELECT (no SKIP LOCKED)
+        db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.outbox_id.in_(outbox_ids), EmailOutbox.status == 'pending')
+            .values(
+                status='sending',
+                claimed_by=token,
+                claimed_at=now,
+                attempts=EmailOutbox.attempts + 1
+            )
+        )
+    db.session.commit()
+
+    if not outbox_ids:
+        return []
+    return EmailOutbox.query.filter_by(claimed_by=token, status='sending').all()
+
+
+def drain_outbox(max_batches=None):
+    """Claim and deliver due rows until none are left, returning (sent, failed)"""
+    sent = failed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = claim_batch()
+        if not rows:
+            break
+        batches += 1
+
+        for row in rows:
+            if row.kind != 'email':
+                if _expand(row):
+                    sent += 1
+                else:
+                    failed += 1
+
+        emails = [row for row in rows if row.kind == 'email']
+        if emails:
+            batch_sent, batch_failed = _deliver(emails)
+            sent += batch_sent
+            failed += batch_failed
+
+    return sent, failed
+
+
+def _deliver(rows):
+    """Send claimed email rows over one batched connection and record the outcome"""
+    errors = {}
+    messages = {}
+    for row in rows:
+        messages[row.outbox_id] = Message(
+            subject=row.subject,
+            recipients=[row.recipient],
+            html=row.html,
+            sender=email_sender()
+        )
+    by_message = {id(msg): outbox_id for outbox_id, msg in messages.items()}
+
+    sent, failed = send_batch(
+        messages.values(),
+        on_error=lambda msg, e: errors.__setitem__(by_message[id(msg)], e)
+    )
+
+    now = datetime.utcnow()
+    for row in rows:
+        error = errors.get(row.outbox_id)
+        if error is None:
+            row.status = 'sent'
+            row.sent_at = now
+            row.claimed_by = None
+        else:
+            _retry_later(row, error)
+    db.session.commit()
+
+    return sent, failed
+
+
+def _expand(row):
+    """Turn a fan-out row into one email row per recipient, in one transaction"""
+    outbox_id = row.outbox_id
+    try:
+        if row.kind not in FANOUTS:
+            raise ValueError(f'unknown outbox kind {row.kind}')
+        payload = json.loads(row.payload)
+
+        event = Event.query.get(payload['event_id'])
+        if event:
+            chunk = []
+            for recipient, html in FANOUTS[row.kind](event, payload):
+                chunk.append({'kind': 'email', 'recipient': recipient, 'subject': row.subject, 'html': html})
+                if len(chunk) >= 500:
+                    db.session.execute(insert(EmailOutbox), chunk)
+                    chunk = []
+            if chunk:
+                db.session.execute(insert(EmailOutbox), chunk)
+
+        row.status = 'sent'
+        row.sent_at = datetime.utcnow()
+        row.claimed_by = None
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        _retry_later(EmailOutbox.query.get(outbox_id), e)
+        db.session.commit()
+        return False
+
+
+def _event_status_emails(event, payload):
+    """(recipient, html) for every active participant of a status fan-out"""
+    participants = Participant.query.options(joinedload(Participant.user)).filter_by(
+        event_id=event.event_id,
+        status='active'
+    ).yield_per(500)
+
+    # Only the participant differs: render the template once and fill it per row
+    skeleton = EmailSkeleton(
+        'event_status',
+        ['participant'],
+        event=event,
+        status=payload['status'],
+        base_url=payload.get('base_url')
+    )
+    for participant in participants:
+        yield participant.user.email, skeleton.render(participant=participant)
+
+
+def _assignment_emails(event, payload):
+    """(recipient, html) for every giver of an assignment fan-out, one email per pair"""
+    # Every giver and receiver user in one joined query, whatever the pair storage
+    people = {
+        participant_id: _Person(name, email)
+        for participant_id, name, email in db.session.query(
+            Participant.participant_id, User.name, User.email
+        ).join(User, Participant.user_id == User.user_id).filter(Participant.event_id == event.event_id)
+    }
+
+    skeleton = EmailSkeleton(
+        'assignment_notification',
+        ['giver', 'receiver'],
+        event=event,
+        base_url=payload.get('base_url')
+    )
+    for giver_id, receiver_id in event_pairs(event.event_id):
+        giver = people.get(giver_id)
+        receiver = people.get(receiver_id)
+        if giver and receiver:
+            yield giver.email, skeleton.render(giver=giver, receiver=receiver)
+
+
+class _Person:
+    """Name and email of a user, all the assignment template reads"""
+
+    def __init__(self, name, email):
+        self.name = name
+        self.email = email
+
+
+# Fan-out kinds: kind -> generator of (recipient, html) for the event
+FANOUTS = {
+    'event_status': _event_status_emails,
+    'assignments': _assignment_emails,
+}
+
+
+def _retry_later(row, error):
+    """Back the row off exponentially, or park it as dead after the last attempt"""
+    config = current_app.config
+    row.claimed_by = None
+    row.last_error = str(error)[:255]
+
+    if _permanent(error):
+        row.status = 'dead'
+        print(f"Error sending email {row.outbox_id}: rejected permanently: {row.last_error}")
+        return
+
+    # An unavailable server (down, bad password) says nothing about the row: never give up on it
+    if row.attempts >= config.get('OUTBOX_MAX_ATTEMPTS', 6) and not isinstance(error, SMTPUnavailable):
+        row.status = 'dead'
+        print(f"Error sending email {row.outbox_id}: giving up after {row.attempts} attempts: {row.last_error}")
+        return
+
+    delay = min(
+        config.get('OUTBOX_BACKOFF_BASE', 30) * 2 ** max(row.attempts - 1, 0),
+        config.get('OUTBOX_BACKOFF_MAX', 3600)
+    )
+    row.status = 'pending'
+    row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+def _permanent(error):
+    """Whether retrying cannot help: the recipient or the message itself was refused with 5xx"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPDataError) and error.smtp_code >= 500
+
+
+class OutboxWorker:
+    """
+    OUTBOX_THREADS daemon threads draining the outbox when woken and every
+    OUTBOX_POLL_INTERVAL seconds. Each claims its own batches, so a large
+    fan-out goes out over that many SMTP connections at once, and never more.
+    """
+
+    # Upper bound on threads (and SMTP connections) per process
+    MAX_THREADS = 8
+
+    def __init__(self):
+        self._threads = []
+        self._app = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        """Start the threads if needed; each drains at once, then every poll interval"""
+        if not app.config.get('OUTBOX_WORKER', True):
+            return False
+
+        count = min(max(int(app.config.get('OUTBOX_THREADS', 2)), 1), self.MAX_THREADS)
+        with self._lock:
+            self._app = app
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < count:
+                thread = threading.Thread(target=self._run, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return True
+
+    def wake(self):
+        """Start the threads if needed and make them drain now"""
+        if self.start(current_app._get_current_object()):
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            with self._app.app_context():
+                try:
+                    drain_outbox()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error draining email outbox: {str(e)}")
+                finally:
+                    db.session.remove()
+                interval = self._app.config.get('OUTBOX_POLL_INTERVAL', 5)
+
+            self._wake.wait(interval)
+
+
+outbox_worker = OutboxWorker()
+
+
+@click.command('drain-outbox')
+@click.option('--once', is_flag=True, help='Drain what is due now and exit.')
+@with_appcontext
+def drain_outbox_command(once):
+    """Send queued email from the outbox (run several to drain in parallel)"""
+    interval = current_app.config.get('OUTBOX_POLL_INTERVAL', 5)
+    while True:
+        sent, failed = drain_outbox()
+        if sent or failed:
+            click.echo(f'{sent} sent, {failed} failed')
+        if once:
+            return
+        time.sleep(interval)
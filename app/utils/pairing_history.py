@@ -0,0 +1,88 @@
+"""
+Cross-event pairing history
+
+Recurring events (the same organizer every year) should not hand out last
+year's giver -> receiver pairs again. PairingHistory loads every past pair for
+an organizer with one query (plus two for events stored packed) and keeps
+them as packed integers, so the engine can check candidates in memory
+instead of querying per pair.
+"""
+from app import db
+from app.models import Event, Participant, Assignment, AssignmentSet
+from app.utils.assignment_store import PackedAssignments
+from sqlalchemy.orm import aliased
+from datetime import datetime, timedelta
+
+
+def _pack(giver_user_id, receiver_user_id):
+    """Pack a user pair into one int (a set of ints is far smaller than a set of tuples)"""
+    return (giver_user_id << 32) | receiver_user_id
+
+
+class PairingHistory:
+    """Past giver -> receiver user pairs for one organizer"""
+    
+    def __init__(self, pairs=()):
+        self._pairs = {_pack(g, r) for g, r in pairs}
+    
+    @classmethod
+    def load(cls, admin_id, years, exclude_event_id=None):
+        """Load the organizer's pairings from the last `years` years in one query"""
+        if not years:
+            return cls()
+        
+        giver = aliased(Participant)
+        receiver = aliased(Participant)
+        cutoff = datetime.utcnow() - timedelta(days=365 * years)
+        
+        event_filters = [Event.admin_id == admin_id, Event.created_at >= cutoff]
+        if exclude_event_id is not None:
+            event_filters.append(Event.event_id != exclude_event_id)
+        
+        query = db.session.query(giver.user_id, receiver.user_id).select_from(Assignment).join(
+            giver, Assignment.giver_id == giver.participant_id
+        ).join(
+            receiver, Assignment.receiver_id == receiver.participant_id
+        ).join(
+            Event, Assignment.event_id == Event.event_id
+        ).filter(*event_filters)
+        
+        return cls(query.all() + cls._packed_pairs(event_filters))
+    
+    @staticmethod
+    def _packed_pairs(event_filters):
+        """User pairs of past events stored packed (one AssignmentSet row each)"""
+        sets = AssignmentSet.query.join(Event, AssignmentSet.event_id == Event.event_id).filter(*event_filters).all()
+        if not sets:
+            return []
+        
+        user_of = dict(db.session.query(
+            Participant.participant_id,
+            Participant.user_id
+        ).filter(Participant.event_id.in_([row.event_id for row in sets])).all())
+        
+        return [
+            (user_of[giver_id], user_of[receiver_id])
+            for row in sets
+            for _, giver_id, receiver_id in PackedAssignments.from_row(row).pairs()
+            if giver_id in user_of and receiver_id in user_of
+        ]
+    
+    def __len__(self):
+        return len(self._pairs)
+    
+    def __contains__(self, pair):
+        return _pack(*pair) in self._pairs
+    
+    def forbidden_for(self, participants):
+        """Translate past user pairs into giver -> {receivers} for this event's participants"""
+        participant_of_user = {p.user_id: p.participant_id for p in participants}
+        forbidden = {}
+        
+        for packed in self._pairs:
+            giver_id = participant_of_user.get(packed >> 32)
+            receiver_id = participant_of_user.get(packed & 0xFFFFFFFF)
+            if giver_id is not None and receiver_id is not None:
+                forbidden.setdefault(giver_id, set()).add(receiver_id)
+        
+        return forbidden
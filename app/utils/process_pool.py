@@ -0,0 +1,42 @@
+"""
+Shared process pool for CPU-bound assignment work
+
+Used by sharded solving and assignment previews. Tasks must be module-level
+functions taking plain, picklable arguments.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+_executor = None
+
+
+def _get_executor(workers):
+    """Process pool shared by every caller in this process"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=workers,
+            # Fresh interpreters: never inherit the parent's DB connections
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor
+
+
+def run_tasks(fn, tasks, workers=1):
+    """
+    Return [fn(*task) for task in tasks], computed on the pool when
+    workers > 1 and there is more than one task. Falls back to running in
+    this process if the pool has died.
+    """
+    global _executor
+
+    if workers > 1 and len(tasks) > 1:
+        try:
+            return list(_get_executor(workers).map(fn, *zip(*tasks)))
+        except BrokenProcessPool as e:
+            # A dead pool stays broken; drop it so the next call starts a new one
+            _executor = None
+            print(f"Error in worker pool, running in process: {str(e)}")
+
+    return [fn(*task) for task in tasks]
@@ -0,0 +1,118 @@
+"""
+Gift deadline reminders
+
+Each tick finds the events whose gift_deadline falls inside the largest of
+the REMINDER_WINDOWS (hours before the deadline) with one range query on
+the gift_deadline index, then reminds every giver of those events whose
+gift is still 'pending' (rows or packed, see assignment_store.pending_givers).
+
+An event is reminded once per window: the tightest window its deadline is
+inside, so an event first seen 20 hours out gets the 24h reminder and not
+the 72h one as well. Every reminder writes a ReminderLog row in the same
+transaction as its outbox email, so a restarted scheduler skips exactly the
+givers that were already reminded.
+
+Run `flask send-reminders` as the scheduler (or with --once from cron).
+"""
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Event, Participant, ReminderLog
+from app.utils.assignment_store import pending_givers
+from app.utils.email_service import send_deadline_reminder_email
+from datetime import datetime, timedelta
+import click
+import time
+
+# Givers loaded and committed per transaction
+CHUNK_SIZE = 500
+
+
+def reminder_windows():
+    """REMINDER_WINDOWS in hours, largest first"""
+    windows = current_app.config.get('REMINDER_WINDOWS', '72,24')
+    if isinstance(windows, str):
+        windows = [part for part in windows.split(',') if part.strip()]
+    return sorted({int(hours) for hours in windows}, reverse=True)
+
+
+def due_events(now=None):
+    """[(event, window_hours)] for assigned, open events with a deadline inside a window"""
+    now = now or datetime.utcnow()
+    windows = reminder_windows()
+    if not windows:
+        return []
+
+    events = Event.query.filter(
+        Event.gift_deadline > now,
+        Event.gift_deadline <= now + timedelta(hours=windows[0]),
+        Event.assignment_done == True,
+        Event.status.notin_(['completed', 'cancelled'])
+    ).order_by(Event.gift_deadline).all()
+
+    due = []
+    for event in events:
+        # Tightest window the deadline is already inside
+        hours_left = (event.gift_deadline - now).total_seconds() / 3600
+        due.append((event, min(hours for hours in windows if hours_left <= hours)))
+    return due
+
+
+def remind_event(event, window_hours):
+    """Queue reminders for the event's pending givers not yet reminded in this window"""
+    reminded = {
+        participant_id for participant_id, in db.session.query(ReminderLog.participant_id).filter_by(
+            event_id=event.event_id,
+            window_hours=window_hours
+        )
+    }
+    giver_ids = sorted(pending_givers(event.event_id) - reminded)
+
+    sent = 0
+    for start in range(0, len(giver_ids), CHUNK_SIZE):
+        participants = Participant.query.options(joinedload(Participant.user)).filter(
+            Participant.participant_id.in_(giver_ids[start:start + CHUNK_SIZE]),
+            Participant.status == 'active'
+        ).all()
+
+        for participant in participants:
+            send_deadline_reminder_email(event, participant)
+            db.session.add(ReminderLog(
+                event_id=event.event_id,
+                participant_id=participant.participant_id,
+                window_hours=window_hours
+            ))
+        # Emails and their log rows commit together
+        db.session.commit()
+        sent += len(participants)
+
+    return sent
+
+
+def send_reminders(now=None):
+    """One scheduler tick: returns the number of reminders queued"""
+    sent = 0
+    for event, window_hours in due_events(now):
+        try:
+            sent += remind_event(event, window_hours)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error sending reminders for event {event.event_id}: {str(e)}")
+    return sent
+
+
+@click.command('send-reminders')
+@click.option('--once', is_flag=True, help='Run a single tick and exit (for cron).')
+@with_appcontext
+def send_reminders_command(once):
+    """Email gift deadline reminders to givers whose gift is still pending"""
+    interval = current_app.config.get('REMINDER_TICK', 900)
+    while True:
+        sent = send_reminders()
+        if sent:
+            click.echo(f'{sent} reminders queued')
+        if once:
+            return
+        db.session.remove()
+        time.sleep(interval)
@@ -0,0 +1,90 @@
+"""
+In-process scheduling
+
+Debouncer collects items under a key (an event, a receiver) and hands each
+key's batch to a callback once no new item has arrived for `delay` seconds,
+and at the latest `max_wait_ratio` delays after the key's first item. One
+daemon thread serves every key and runs callbacks inside an app context.
+
+Batches still waiting when the process exits are lost, so only schedule
+work that is safe to redo or skip (rescoring, digests).
+"""
+from flask import current_app
+from app import db
+import threading
+import time
+
+
+class Debouncer:
+    """Batch items per key and run callback(key, items) after a quiet period"""
+
+    def __init__(self, callback, delay_setting, default_delay=5.0, max_wait_ratio=6.0):
+        # Delay comes from config[delay_setting]; 0 runs the callback at once
+        self.callback = callback
+        self.delay_setting = delay_setting
+        self.default_delay = default_delay
+        self.max_wait_ratio = max_wait_ratio
+        self._pending = {}  # key -> [items, deadline, hard deadline]
+        self._condition = threading.Condition()
+        self._thread = None
+        self._app = None
+
+    def add(self, key, item):
+        """Queue item under key, pushing the key's deadline back by the delay"""
+        delay = float(current_app.config.get(self.delay_setting, self.default_delay))
+        if delay <= 0:
+            self.callback(key, [item])
+            return
+
+        with self._condition:
+            self._app = current_app._get_current_object()
+            now = time.monotonic()
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = [[], now + delay, now + delay * self.max_wait_ratio]
+            entry[0].append(item)
+            entry[1] = min(now + delay, entry[2])
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def pending(self):
+        """Number of keys waiting to run"""
+        with self._condition:
+            return len(self._pending)
+
+    def flush(self):
+        """Run every waiting batch now, in this thread (tests, shutdown)"""
+        with self._condition:
+            batches = list(self._pending.items())
+            self._pending.clear()
+        for key, (items, _, _) in batches:
+            self._call(key, items)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    due = [key for key, entry in self._pending.items() if entry[1] <= now]
+                    if due:
+                        break
+                    next_deadline = min((entry[1] for entry in self._pending.values()), default=None)
+                    self._condition.wait(None if next_deadline is None else next_deadline - now)
+
+                batches = [(key, self._pending.pop(key)[0]) for key in due]
+                app = self._app
+
+            with app.app_context():
+                for key, items in batches:
+                    self._call(key, items)
+
+    def _call(self, key, items):
+        try:
+            self.callback(key, items)
+        except Exception as e:
+            # One bad batch must not stop the thread serving every other key
+            db.session.rollback()
+            print(f"Error in scheduled batch {key}: {str(e)}")
@@ -0,0 +1,141 @@
+"""
+Sharded assignment for very large events
+
+Participants are split into shards by their group key (department, office).
+Every shard is assigned on its own in a worker process, then the shard
+results are stitched into one set of assignment maps. Only plain ids are
+sent to the workers; nothing here touches the database.
+"""
+from app.utils.matching import disjoint_assignments, is_allowed
+from app.utils.process_pool import run_tasks
+import math
+import random
+
+
+def partition(groups, min_size, max_size, rng=None):
+    """
+    Split ``{group_key: [ids]}`` into shards (lists of ids).
+
+    Groups smaller than min_size are pooled together; if the pool itself
+    stays too small it joins the smallest shard. Groups (and the pool)
+    larger than max_size are split into random, near-equal chunks so one
+    huge department does not serialize the whole run.
+    """
+    rng = rng or random.Random()
+    shards = []
+    pooled = []
+
+    def split(ids):
+        rng.shuffle(ids)
+        chunks = math.ceil(len(ids) / max_size)
+        shards.extend(ids[i::chunks] for i in range(chunks))
+
+    # Fixed order so the same seed gives the same shards
+    for key in sorted(groups, key=lambda key: (key is None, key or '')):
+        ids = list(groups[key])
+        if len(ids) < min_size:
+            pooled.extend(ids)
+        else:
+            split(ids)
+
+    if len(pooled) >= min_size or (pooled and not shards):
+        split(pooled)
+    elif pooled:
+        min(shards, key=len).extend(pooled)
+
+    return shards
+
+
+def _restrict(forbidden, ids):
+    """Forbidden pairs with both ends inside ids"""
+    id_set = set(ids)
+    restricted = {}
+    for giver_id in ids:
+        receiver_ids = forbidden.get(giver_id)
+        if receiver_ids:
+            inside = receiver_ids & id_set
+            if inside:
+                restricted[giver_id] = inside
+    return restricted
+
+
+def solve_shard(ids, k, forbidden, seed):
+    """Worker entry point: k disjoint assignment maps for one shard"""
+    return disjoint_assignments(ids, k, forbidden, random.Random(seed))
+
+
+def solve_shards(shards, k, forbidden, rng=None, workers=1):
+    """
+    Solve every shard (in parallel when workers > 1) and stitch the results.
+
+    A shard the exclusion rules make infeasible is merged with the smallest
+    solved shard and solved again here, once. Returns ``(slot_maps, None)``
+    or ``(None, blocked)`` like disjoint_assignments().
+    """
+    rng = rng or random.Random()
+    tasks = [(ids, k, _restrict(forbidden, ids), rng.getrandbits(64)) for ids in shards]
+    results = run_tasks(solve_shard, tasks, workers)
+
+    failed = [i for i, (slot_maps, _) in enumerate(results) if slot_maps is None]
+    solved = [i for i, (slot_maps, _) in enumerate(results) if slot_maps is not None]
+
+    if failed:
+        if not solved:
+            return results[failed[0]]
+
+        partner = min(solved, key=lambda i: len(shards[i]))
+        merged = [pid for i in failed + [partner] for pid in shards[i]]
+        retry = solve_shard(merged, k, _restrict(forbidden, merged), rng.getrandbits(64))
+        if retry[0] is None:
+            return retry
+
+        results = [results[i] for i in solved if i != partner] + [retry]
+
+    slot_maps = [{} for _ in range(k)]
+    for shard_maps, _ in results:
+        for slot, assignment_map in enumerate(shard_maps):
+            slot_maps[slot].update(assignment_map)
+
+    return slot_maps, None
+
+
+def mix_shards(slot_maps, shards, forbidden, rng=None, tries=16):
+    """
+    Add cross-group pairs, in place: in every slot one giver is picked per
+    shard and each passes their receiver to the giver picked before them.
+    That rotation links one gift chain from every shard into one chain. A
+    shard is left out of a rotation when no allowed pick is found for it.
+    """
+    rng = rng or random.Random()
+    if len(shards) < 2:
+        return
+
+    for assignment_map in slot_maps:
+        others = [m for m in slot_maps if m is not assignment_map]
+
+        def allowed(giver_id, receiver_id):
+            return (is_allowed(giver_id, receiver_id, forbidden)
+                    and all(m.get(giver_id) != receiver_id for m in others))
+
+        order = list(shards)
+        rng.shuffle(order)
+
+        # picks[i] will give to the current receiver of picks[i + 1]
+        picks = [rng.choice(order[0])]
+        for shard in order[1:]:
+            for _ in range(tries):
+                candidate = rng.choice(shard)
+                if allowed(picks[-1], assignment_map[candidate]):
+                    picks.append(candidate)
+                    break
+
+        # Close the rotation: the last pick takes the first pick's receiver
+        while len(picks) > 1 and not allowed(picks[-1], assignment_map[picks[0]]):
+            picks.pop()
+
+        if len(picks) < 2:
+            continue
+
+        receivers = [assignment_map[giver_id] for giver_id in picks]
+        for i, giver_id in enumerate(picks):
+            assignment_map[giver_id] = receivers[(i + 1) % len(picks)]
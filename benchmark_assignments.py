@@ -0,0 +1,302 @@
+"""
+Assignment Engine Benchmark and Fuzz Suite
+Runs SmartAssignmentEngine against in-memory SQLite (TestingConfig) and reports
+generation time, query count and peak memory per event size and exclusion
+density. Every generated assignment is property-checked: it must be a
+bijection over active participants, contain no self-pairs and respect every
+exclusion rule. A query-count check runs each mode on two event sizes with
+wishlists and fails if the number of SQL statements differs, so per-pair or
+per-participant queries cannot creep back in.
+
+Usage:
+    python benchmark_assignments.py
+    python benchmark_assignments.py --sizes 10,1000,1000000 --densities 0,5
+    python benchmark_assignments.py --fuzz 500 --seed 7
+"""
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from sqlalchemy import event as sa_event, insert
+from app import create_app, db
+from app.models import User, Event, Participant, ExclusionRule, Wishlist
+from app.utils.assignment_engine import SmartAssignmentEngine
+from app.utils.assignment_store import event_pairs
+
+# Event sizes the query-count check compares (both below ASSIGNMENT_COMPACT_SIZE)
+QUERY_CHECK_SIZES = (50, 500)
+
+
+class QueryCounter:
+    """Count SQL statements sent to the database"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        sa_event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        sa_event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def build_event(size, rules_per_participant, rng, wishlists=False):
+    """Create a fresh event with `size` active participants and random exclusion rules"""
+    db.drop_all()
+    db.create_all()
+
+    admin = User(name='Benchmark Admin', email='admin@benchmark.local', password='x')
+    db.session.add(admin)
+    db.session.flush()
+
+    event = Event(event_name='Benchmark', admin_id=admin.user_id, invite_code='BENCH001')
+    db.session.add(event)
+    db.session.flush()
+
+    db.session.execute(insert(User), [
+        {'name': f'User {i}', 'email': f'user{i}@benchmark.local', 'password': 'x'}
+        for i in range(size)
+    ])
+    user_ids = [uid for (uid,) in db.session.query(User.user_id).filter(User.user_id != admin.user_id)]
+
+    db.session.execute(insert(Participant), [
+        {'event_id': event.event_id, 'user_id': uid, 'status': 'active'}
+        for uid in user_ids
+    ])
+    participant_ids = [pid for (pid,) in db.session.query(Participant.participant_id)]
+
+    if wishlists:
+        db.session.execute(insert(Wishlist), [
+            {
+                'user_id': uid,
+                'event_id': event.event_id,
+                'gift_category': rng.choice(['Books', 'Tech', 'Clothes', 'Games']),
+                'hobby_tags': ', '.join(rng.sample(['music', 'hiking', 'cooking', 'art', 'sports'], 2)),
+                'color_preference': rng.choice(['red', 'green', 'blue'])
+            }
+            for uid in user_ids
+        ])
+
+    pairs = set()
+    target = min(int(rules_per_participant * size), size * (size - 1))
+    while len(pairs) < target and size > 1:
+        giver_id, receiver_id = rng.sample(participant_ids, 2)
+        pairs.add((giver_id, receiver_id))
+
+    if pairs:
+        db.session.execute(insert(ExclusionRule), [
+            {
+                'event_id': event.event_id,
+                'giver_id': giver_id,
+                'receiver_id': receiver_id,
+                'rule_type': 'custom',
+                'bidirectional': rng.random() < 0.5
+            }
+            for giver_id, receiver_id in pairs
+        ])
+
+    db.session.commit()
+    return event.event_id
+
+
+def check_properties(event_id):
+    """Return a list of property violations for the event's assignments"""
+    problems = []
+
+    active = {pid for (pid,) in db.session.query(Participant.participant_id).filter_by(
+        event_id=event_id, status='active'
+    )}
+    pairs = event_pairs(event_id)
+    givers = [g for g, _ in pairs]
+    receivers = [r for _, r in pairs]
+
+    if set(givers) != active or len(givers) != len(active):
+        problems.append('givers are not exactly the active participants')
+    if set(receivers) != active or len(receivers) != len(active):
+        problems.append('receivers are not exactly the active participants')
+    if any(g == r for g, r in pairs):
+        problems.append('self-assignment found')
+
+    assigned = set(pairs)
+    for giver_id, receiver_id, bidirectional in db.session.query(
+        ExclusionRule.giver_id, ExclusionRule.receiver_id, ExclusionRule.bidirectional
+    ).filter_by(event_id=event_id):
+        if (giver_id, receiver_id) in assigned or (bidirectional and (receiver_id, giver_id) in assigned):
+            problems.append(f'exclusion {giver_id}->{receiver_id} violated')
+            break
+
+    return problems
+
+
+def run_engine(event_id, seed, mode, measure_memory):
+    """Generate assignments once; return (engine, result, seconds, queries, peak_bytes)"""
+    if measure_memory:
+        tracemalloc.start()
+
+    with QueryCounter(db.engine) as counter:
+        start = time.perf_counter()
+        engine = SmartAssignmentEngine(event_id, seed=seed)
+        result = engine.generate_assignments(mode=mode)
+        db.session.flush()
+        elapsed = time.perf_counter() - start
+
+    peak = 0
+    if measure_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return engine, result, elapsed, counter.count, peak
+
+
+def benchmark(sizes, densities, modes, seed, measure_memory):
+    """Benchmark table across sizes, exclusion densities and modes"""
+    print("=" * 78)
+    print(f"{'size':>9} {'rules/p':>8} {'mode':>14} {'ok':>4} {'seconds':>9} {'queries':>8} {'peak MB':>9}  checks")
+    print("=" * 78)
+
+    failures = 0
+    for size in sizes:
+        for density in densities:
+            for mode in modes:
+                if mode == 'compatibility' and size > SmartAssignmentEngine.MAX_COMPATIBILITY_SIZE:
+                    print(f"{size:>9} {density:>8} {mode:>14}  skipped (above MAX_COMPATIBILITY_SIZE)")
+                    continue
+
+                rng = random.Random(f'{seed}-{size}-{density}')
+                event_id = build_event(size, density, rng)
+
+                # Time without tracemalloc, then measure memory on an identical run
+                engine, result, elapsed, queries, _ = run_engine(event_id, seed, mode, False)
+                if result['success']:
+                    problems = check_properties(event_id)
+                else:
+                    # Dense rules on tiny events may be infeasible; the report must then be right
+                    problems = check_blocked_group(engine, result) or ['infeasible (verified)']
+                db.session.rollback()
+
+                peak = 0
+                if measure_memory:
+                    _, _, _, _, peak = run_engine(event_id, seed, mode, True)
+                    db.session.rollback()
+
+                failures += bool(problems) and problems != ['infeasible (verified)']
+                print(f"{size:>9} {density:>8} {mode:>14} {'yes' if result['success'] else 'no':>4} "
+                      f"{elapsed:>9.3f} {queries:>8} {peak / 1e6:>9.1f}  {'; '.join(problems) or 'OK'}")
+
+    return failures
+
+
+def query_scaling(modes, seed):
+    """Each mode must send the same number of queries at every QUERY_CHECK_SIZES size"""
+    print("\n" + "=" * 78)
+    print(f"QUERY COUNT: sizes {', '.join(str(size) for size in QUERY_CHECK_SIZES)} with wishlists")
+    print("=" * 78)
+
+    failures = 0
+    for mode in modes:
+        counts = []
+        for size in QUERY_CHECK_SIZES:
+            event_id = build_event(size, 1, random.Random(f'{seed}-{size}'), wishlists=True)
+            _, result, _, queries, _ = run_engine(event_id, seed, mode, False)
+            db.session.rollback()
+            counts.append(queries if result['success'] else None)
+
+        constant = None not in counts and len(set(counts)) == 1
+        failures += not constant
+        print(f"   {'✅' if constant else '❌'} {mode:>14}: {' / '.join(str(count) for count in counts)} queries")
+
+    return failures
+
+
+def fuzz(rounds, seed):
+    """Random small events, including infeasible ones; every answer must be correct"""
+    print("\n" + "=" * 78)
+    print(f"FUZZ: {rounds} rounds (seed {seed})")
+    print("=" * 78)
+
+    rng = random.Random(seed)
+    failures = 0
+    infeasible = 0
+
+    for round_number in range(rounds):
+        size = rng.randint(2, 40)
+        density = rng.choice([0, 0.5, 2, size / 3, size / 1.5])
+        event_id = build_event(size, density, rng)
+
+        engine = SmartAssignmentEngine(event_id, seed=rng.getrandbits(32))
+        result = engine.generate_assignments()
+        db.session.flush()
+
+        if result['success']:
+            problems = check_properties(event_id)
+        else:
+            infeasible += 1
+            problems = check_blocked_group(engine, result)
+        db.session.rollback()
+
+        if problems:
+            failures += 1
+            print(f"   ❌ round {round_number}: size={size} rules/p={density:.2f}: {'; '.join(problems)}")
+
+    print(f"   {rounds - failures}/{rounds} rounds correct ({infeasible} reported infeasible)")
+    return failures
+
+
+def check_blocked_group(engine, result):
+    """An infeasibility report must name a real Hall violator"""
+    blocked_givers = result.get('blocked_givers')
+    if not blocked_givers:
+        return [f"failed without a blocking group: {result['message']}"]
+
+    forbidden = engine._load_forbidden_pairs()
+    participant_ids = [p.participant_id for p in engine.participants]
+    reachable = {
+        receiver_id
+        for giver_id in blocked_givers
+        for receiver_id in participant_ids
+        if receiver_id != giver_id and receiver_id not in forbidden.get(giver_id, ())
+    }
+
+    if len(reachable) >= len(blocked_givers):
+        return [f'reported group of {len(blocked_givers)} can reach {len(reachable)} receivers']
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark and fuzz the assignment engine')
+    parser.add_argument('--sizes', default='10,100,1000,10000,100000',
+                        help='comma-separated participant counts (up to 1000000)')
+    parser.add_argument('--densities', default='0,1,10',
+                        help='comma-separated exclusion rules per participant')
+    parser.add_argument('--modes', default='random',
+                        help='comma-separated engine modes (compatibility needs numpy/scipy)')
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--fuzz', type=int, default=200, help='fuzz rounds (0 to skip)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    densities = [float(d) for d in args.densities.split(',') if d]
+    modes = [m for m in args.modes.split(',') if m]
+
+    app = create_app('testing')
+    app.config['ASSIGNMENT_HISTORY_YEARS'] = 0
+
+    with app.app_context():
+        failures = benchmark(sizes, densities, modes, args.seed, not args.no_memory)
+        failures += query_scaling(modes, args.seed)
+        if args.fuzz:
+            failures += fuzz(args.fuzz, args.seed)
+
+    print("\n" + ("✅ All checks passed" if not failures else f"❌ {failures} failing cases"))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Email Throughput Benchmark
+Sends messages through Flask-Mail against a local SMTP stand-in and reports
+messages per second and SMTP connections used, comparing one connection per
+message (mail.send) with send_batch, plus the full event status fan-out
+through the outbox over an in-memory SQLite event. Every run checks that the
+server received exactly the messages that were reported sent. The jinja and
+skeleton modes only render the status email, per recipient or once per
+fan-out. With the built-in stand-in a last check makes it refuse every login
+(535) and drains the outbox: all rows must stay pending with backoff, none
+dead and nothing sent.
+
+The built-in stand-in accepts everything and can simulate the cost of a real
+handshake (TLS + login) with --handshake-ms and dropped connections with
+--drop-every. Point --host/--port at another server (for example
+`python -m aiosmtpd -n -l localhost:8025`) to skip it.
+
+Usage:
+    python benchmark_email.py
+    python benchmark_email.py --messages 2000 --handshake-ms 50 --drop-every 150
+    python benchmark_email.py --host localhost --port 8025 --modes batched
+"""
+import argparse
+import socketserver
+import sys
+import threading
+import time
+from sqlalchemy import insert
+from datetime import datetime
+from app import create_app, db, mail
+from app.models import User, Event, Participant, EmailOutbox
+from app.utils.email_service import (
+    build_email, send_batch, send_event_status_emails, render_email, EmailSkeleton
+)
+from app.utils.outbox import drain_outbox
+
+# Modes that only render, to compare per-recipient Jinja with one EmailSkeleton
+RENDER_MODES = ('jinja', 'skeleton')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Minimal SMTP server that accepts and counts every message"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handshake_delay=0.0, drop_every=0):
+        super().__init__(address, SMTPHandler)
+        self.handshake_delay = handshake_delay
+        self.drop_every = drop_every
+        self.reject_auth = False
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+
+    def reset(self):
+        with self.lock:
+            self.connections = 0
+            self.messages = 0
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """One SMTP session: just enough of RFC 5321 for smtplib"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        time.sleep(server.handshake_delay)
+        self.reply('220 localhost benchmark sink')
+
+        received = 0
+        for raw in self.rfile:
+            command = raw.decode(errors='replace').strip().upper()
+            if command.startswith('EHLO'):
+                # One write: two small ones stall on Nagle + delayed ACK
+                self.reply('250-localhost\r\n250 AUTH PLAIN LOGIN')
+            elif command.startswith('HELO'):
+                self.reply('250 localhost')
+            elif command.startswith('AUTH'):
+                if server.reject_auth:
+                    self.reply('535 5.7.8 Username and Password not accepted')
+                else:
+                    self.reply('235 2.7.0 Authentication successful')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                received += 1
+                with server.lock:
+                    server.messages += 1
+                self.reply('250 OK')
+                if server.drop_every and received % server.drop_every == 0:
+                    return  # hang up without a word, like a relay timing us out
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                self.reply('250 OK')
+
+
+def build_participants(count):
+    """Unsaved event and participants to render status emails for"""
+    event = Event(event_id=1, event_name='Benchmark Party', invite_code='BENCH001')
+    participants = [
+        Participant(user=User(name=f'User {i}', email=f'user{i}@benchmark.local'))
+        for i in range(count)
+    ]
+    return event, participants
+
+
+def build_messages(count):
+    """Rendered messages like the ones a status broadcast sends"""
+    event, participants = build_participants(count)
+    messages = []
+    for participant in participants:
+        messages.append(build_email(
+            subject='📢 Event Update: Benchmark Party - Rescheduled',
+            recipients=[participant.user.email],
+            template='event_status',
+            event=event,
+            participant=participant,
+            status='rescheduled'
+        ))
+    return messages
+
+
+def build_event(size):
+    """Create an event with `size` active participants"""
+    db.drop_all()
+    db.create_all()
+
+    admin = User(name='Benchmark Admin', email='admin@benchmark.local', password='x')
+    db.session.add(admin)
+    db.session.flush()
+
+    event = Event(event_name='Benchmark Party', admin_id=admin.user_id, invite_code='BENCH001')
+    db.session.add(event)
+    db.session.flush()
+
+    db.session.execute(insert(User), [
+        {'name': f'User {i}', 'email': f'user{i}@benchmark.local', 'password': 'x'}
+        for i in range(size)
+    ])
+    user_ids = [u.user_id for u in User.query.filter(User.user_id != admin.user_id)]
+    db.session.execute(insert(Participant), [
+        {'event_id': event.event_id, 'user_id': user_id, 'status': 'active'}
+        for user_id in user_ids
+    ])
+    db.session.commit()
+    return event.event_id
+
+
+def run_mode(app, mode, count, sink):
+    """Send (or for jinja/skeleton, only render) `count` messages in one mode, returning (done, seconds)"""
+    if mode in RENDER_MODES:
+        event, participants = build_participants(count)
+        start = time.perf_counter()
+        if mode == 'jinja':
+            for participant in participants:
+                render_email('event_status', event=event, participant=participant, status='rescheduled')
+        else:
+            skeleton = EmailSkeleton('event_status', ['participant'], event=event, status='rescheduled')
+            for participant in participants:
+                skeleton.render(participant=participant)
+        return count, time.perf_counter() - start
+
+    if mode == 'fanout':
+        event_id = build_event(count)
+        start = time.perf_counter()
+        send_event_status_emails(db.session.get(Event, event_id), 'rescheduled')
+        db.session.commit()
+        sent, _ = drain_outbox()
+        # The fan-out row itself counts as one
+        return sent - 1, time.perf_counter() - start
+
+    messages = build_messages(count)
+    start = time.perf_counter()
+    if mode == 'single':
+        sent = 0
+        for msg in messages:
+            try:
+                mail.send(msg)
+                sent += 1
+            except Exception as e:
+                print(f'  send failed: {e}')
+    else:
+        sent, _ = send_batch(messages)
+    return sent, time.perf_counter() - start
+
+
+def check_auth_failure(app, count, sink):
+    """Drain `count` rows against a server refusing the login; returns a list of problems"""
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(EmailOutbox), [
+        {'kind': 'email', 'recipient': f'user{i}@benchmark.local', 'subject': 'Auth check', 'html': '<p>x</p>'}
+        for i in range(count)
+    ])
+    db.session.commit()
+
+    sink.reset()
+    sink.reject_auth = True
+    app.config.update(MAIL_USERNAME='benchmark', MAIL_PASSWORD='rotated')
+    mail.init_app(app)
+    try:
+        sent, failed = drain_outbox(max_batches=1)
+    finally:
+        sink.reject_auth = False
+        app.config.update(MAIL_USERNAME=None, MAIL_PASSWORD=None)
+        mail.init_app(app)
+
+    problems = []
+    rows = EmailOutbox.query.all()
+    if sent or sink.messages:
+        problems.append(f'{sent} reported sent, server received {sink.messages}')
+    if any(row.status == 'dead' for row in rows):
+        problems.append(f"{sum(row.status == 'dead' for row in rows)} rows dead-lettered")
+    claimed = [row for row in rows if row.attempts]
+    if any(row.status != 'pending' or row.next_attempt_at <= datetime.utcnow() for row in claimed):
+        problems.append('claimed rows not pending with backoff')
+    if sink.connections > 1:
+        problems.append(f'{sink.connections} logins tried, the batch should stop after the first')
+    print(f"    auth {len(claimed)} rows refused at login: "
+          f"{'; '.join(problems) or 'all pending with backoff, none dead'}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bulk email sending')
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--modes', default='single,batched,fanout,jinja,skeleton',
+                        help='comma-separated: single (mail.send each), batched (send_batch), '
+                             'fanout (status fan-out via the outbox), jinja / skeleton (render only)')
+    parser.add_argument('--host', help='external SMTP server (default: built-in stand-in)')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--handshake-ms', type=float, default=20,
+                        help='stand-in delay before the greeting, to model TLS + login')
+    parser.add_argument('--drop-every', type=int, default=0,
+                        help='stand-in hangs up after this many messages on a connection')
+    parser.add_argument('--batch-size', type=int, default=200)
+    args = parser.parse_args()
+
+    sink = None
+    host, port = args.host, args.port
+    if host is None:
+        sink = SMTPSink(('127.0.0.1', 0), args.handshake_ms / 1000.0, args.drop_every)
+        host, port = sink.server_address
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+
+    app = create_app('testing')
+    app.config.update(
+        MAIL_SERVER=host,
+        MAIL_PORT=port,
+        MAIL_USE_TLS=False,
+        MAIL_USE_SSL=False,
+        MAIL_USERNAME=None,
+        MAIL_PASSWORD=None,
+        MAIL_DEFAULT_SENDER='noreply@benchmark.local',
+        MAIL_SUPPRESS_SEND=False,
+        MAIL_DEBUG=False,
+        MAIL_BATCH_SIZE=args.batch_size,
+        OUTBOX_BATCH_SIZE=args.batch_size,
+        OUTBOX_WORKER=False,
+    )
+    mail.init_app(app)
+
+    ok = True
+    print(f"{'mode':>8} {'messages':>9} {'seconds':>9} {'msg/s':>9} {'connections':>12}")
+    # No request context, like a mail worker
+    with app.app_context():
+        for mode in args.modes.split(','):
+            if sink:
+                sink.reset()
+            sent, seconds = run_mode(app, mode, args.messages, sink)
+
+            connections = '-'
+            if sink and mode not in RENDER_MODES:
+                # The server may still be acknowledging the last QUIT
+                time.sleep(0.05)
+                connections = sink.connections
+                if sink.messages != sent:
+                    ok = False
+                    print(f'  MISMATCH: reported {sent} sent, server received {sink.messages}')
+            if sent != args.messages:
+                ok = False
+                print(f'  SHORT: {sent} of {args.messages} sent')
+
+            rate = sent / seconds if seconds else float('inf')
+            print(f'{mode:>8} {sent:>9} {seconds:>9.3f} {rate:>9.0f} {connections:>12}')
+
+        if sink and check_auth_failure(app, args.messages, sink):
+            ok = False
+
+    if sink:
+        sink.shutdown()
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,8 @@ from datetime import timedelta
 class Config:
     """Base configuration"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-change-this-in-production'
+    # Keys the invite code permutation (SECRET_KEY when unset); never change it once events exist
+    INVITE_CODE_KEY = os.environ.get('INVITE_CODE_KEY')
     
     # Database configuration
     MYSQL_HOST = os.environ.get('MYSQL_HOST') or 'localhost'    
@@ -38,6 +40,28 @@ class Config:
     
     # Pagination
     POSTS_PER_PAGE = 10
+    EVENTS_PER_PAGE = int(os.environ.get('EVENTS_PER_PAGE') or 24)
+    
+    # Assignments: avoid repeating pairs from the organizer's events in the last N years (0 = off)
+    ASSIGNMENT_HISTORY_YEARS = int(os.environ.get('ASSIGNMENT_HISTORY_YEARS') or 3)
+    # Events at least this large are assigned in a background worker process
+    ASSIGNMENT_ASYNC_THRESHOLD = int(os.environ.get('ASSIGNMENT_ASYNC_THRESHOLD') or 2000)
+    ASSIGNMENT_JOB_WORKERS = int(os.environ.get('ASSIGNMENT_JOB_WORKERS') or 2)
+    # A queued or running job with no progress for this many seconds is marked failed
+    ASSIGNMENT_JOB_TIMEOUT = int(os.environ.get('ASSIGNMENT_JOB_TIMEOUT') or 1800)
+    # CPU worker processes for sharded solving and assignment previews, started (once per
+    # process) only for events of at least ASSIGNMENT_POOL_MIN_SIZE; smaller ones solve in-process
+    ASSIGNMENT_POOL_WORKERS = int(os.environ.get('ASSIGNMENT_POOL_WORKERS') or min(4, os.cpu_count() or 1))
+    ASSIGNMENT_POOL_MIN_SIZE = int(os.environ.get('ASSIGNMENT_POOL_MIN_SIZE') or 50000)
+    # Sharded mode: largest shard, and smallest group kept on its own
+    ASSIGNMENT_SHARD_SIZE = int(os.environ.get('ASSIGNMENT_SHARD_SIZE') or 20000)
+    ASSIGNMENT_MIN_SHARD_SIZE = int(os.environ.get('ASSIGNMENT_MIN_SHARD_SIZE') or 10)
+    # Candidates solved and scored for one assignment preview
+    ASSIGNMENT_PREVIEW_CANDIDATES = int(os.environ.get('ASSIGNMENT_PREVIEW_CANDIDATES') or 8)
+    # Events at least this large store their pairs packed in one row (0 = always one row per pair)
+    ASSIGNMENT_COMPACT_SIZE = int(os.environ.get('ASSIGNMENT_COMPACT_SIZE') or 5000)
+    # Seconds of quiet after wishlist edits before their pairs are rescored (0 = rescore at once)
+    WISHLIST_RESCORE_DELAY = float(os.environ.get('WISHLIST_RESCORE_DELAY') or 5)
     
     # Email configuration (for notifications)
     MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.gmail.com'
@@ -46,6 +70,29 @@ class Config:
     # SMTP credentials - must be provided via environment variables in production
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME') or 'your-email@example.com'
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD') or 'change-this-password'
+    # Links in emails rendered outside a request (mail workers, digests, CLI);
+    # Render sets RENDER_EXTERNAL_URL for the deployed service
+    APP_BASE_URL = os.environ.get('APP_BASE_URL') or os.environ.get('RENDER_EXTERNAL_URL') or 'http://localhost:5000'
+    # Bulk sends: messages per SMTP connection, and tries per message on a dropped connection
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 200)
+    MAIL_SEND_ATTEMPTS = int(os.environ.get('MAIL_SEND_ATTEMPTS') or 3)
+    # Seconds from a receiver's first new message until one digest email covers all of them (0 = email each message)
+    MESSAGE_DIGEST_WINDOW = float(os.environ.get('MESSAGE_DIGEST_WINDOW') or 300)
+    # Deadline reminders: hours before gift_deadline to remind pending givers, and seconds between scheduler ticks
+    REMINDER_WINDOWS = os.environ.get('REMINDER_WINDOWS') or '72,24'
+    REMINDER_TICK = float(os.environ.get('REMINDER_TICK') or 900)
+    # Email outbox: rows claimed per batch, retries (backoff doubles from BASE
+    # up to MAX seconds) before a row is dead, and when a claim counts as abandoned
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE') or 100)
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS') or 6)
+    OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE') or 30)
+    OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX') or 3600)
+    OUTBOX_CLAIM_TIMEOUT = float(os.environ.get('OUTBOX_CLAIM_TIMEOUT') or 600)
+    OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL') or 5)
+    # Drain in threads of every web process; turn off when only `flask drain-outbox` workers should send.
+    # OUTBOX_THREADS is the send concurrency per process (at most 8 SMTP connections)
+    OUTBOX_WORKER = os.environ.get('OUTBOX_WORKER', 'true').lower() in ['true', 'on', '1']
+    OUTBOX_THREADS = int(os.environ.get('OUTBOX_THREADS') or 2)
 
 class DevelopmentConfig(Config):
     """Development configuration"""
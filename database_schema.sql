@@ -43,6 +43,9 @@ CREATE TABLE events (
     invite_code VARCHAR(20) NOT NULL UNIQUE,
     status VARCHAR(20) DEFAULT 'pending' COMMENT 'pending, active, completed, cancelled',
     assignment_done BOOLEAN DEFAULT FALSE,
+    chain_length INT NULL COMMENT 'Longest gift chain; equals participant count for a single ring',
+    gifts_per_giver INT DEFAULT 1 COMMENT 'Gifts each participant gives and receives',
+    mix_groups BOOLEAN DEFAULT FALSE COMMENT 'Sharded mode: also pair some people across groups',
     privacy_type VARCHAR(20) DEFAULT 'public' COMMENT 'public, private',
     visibility VARCHAR(20) DEFAULT 'all' COMMENT 'all, participants_only, invite_only',
     allow_public_join BOOLEAN DEFAULT TRUE COMMENT 'Can anyone with invite code join?',
@@ -51,6 +54,8 @@ CREATE TABLE events (
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     INDEX idx_invite_code (invite_code),
+    INDEX idx_gift_deadline (gift_deadline),
+    INDEX idx_events_created (created_at, event_id),
     FOREIGN KEY (admin_id) REFERENCES users(user_id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 COMMENT='Secret Santa events table';
@@ -88,6 +93,7 @@ CREATE TABLE participants (
     wishlist_id INT NULL,
     joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     status VARCHAR(20) DEFAULT 'active' COMMENT 'active, dropped, completed',
+    group_key VARCHAR(100) NULL COMMENT 'Department / office; sharded assignment pairs within it',
     UNIQUE KEY unique_participant (event_id, user_id),
     FOREIGN KEY (event_id) REFERENCES events(event_id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
@@ -104,10 +110,13 @@ CREATE TABLE assignments (
     event_id INT NOT NULL,
     giver_id INT NOT NULL,
     receiver_id INT NOT NULL,
+    slot INT NOT NULL DEFAULT 0 COMMENT '0 .. gifts_per_giver - 1',
     compatibility_score FLOAT DEFAULT 0.0,
     assigned_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     gift_status VARCHAR(20) DEFAULT 'pending' COMMENT 'pending, purchased, delivered',
-    UNIQUE KEY unique_giver (event_id, giver_id),
+    UNIQUE KEY unique_giver_slot (event_id, giver_id, slot),
+    UNIQUE KEY unique_receiver_slot (event_id, receiver_id, slot),
+    UNIQUE KEY unique_pair (event_id, giver_id, receiver_id),
     FOREIGN KEY (event_id) REFERENCES events(event_id) ON DELETE CASCADE,
     FOREIGN KEY (giver_id) REFERENCES participants(participant_id) ON DELETE CASCADE,
     FOREIGN KEY (receiver_id) REFERENCES participants(participant_id) ON DELETE CASCADE
@@ -133,6 +142,120 @@ CREATE TABLE messages (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 COMMENT='Anonymous messages table';
 
+-- =====================================================
+-- Table 7: exclusion_rules
+-- Pairs that must never be matched (couples, households, managers)
+-- =====================================================
+CREATE TABLE exclusion_rules (
+    rule_id INT AUTO_INCREMENT PRIMARY KEY,
+    event_id INT NOT NULL,
+    giver_id INT NOT NULL,
+    receiver_id INT NOT NULL,
+    rule_type VARCHAR(20) DEFAULT 'custom' COMMENT 'couple, household, manager, custom',
+    bidirectional BOOLEAN DEFAULT TRUE COMMENT 'Also block receiver -> giver',
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY unique_exclusion (event_id, giver_id, receiver_id),
+    INDEX idx_exclusion_event (event_id),
+    FOREIGN KEY (event_id) REFERENCES events(event_id) ON DELETE CASCADE,
+    FOREIGN KEY (giver_id) REFERENCES participants(participant_id) ON DELETE CASCADE,
+    FOREIGN KEY (receiver_id) REFERENCES participants(participant_id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Assignment exclusion rules table';
+
+-- =====================================================
+-- Table 8: assignment_jobs
+-- Background assignment runs for large events
+-- =====================================================
+CREATE TABLE assignment_jobs (
+    job_id INT AUTO_INCREMENT PRIMARY KEY,
+    event_id INT NOT NULL,
+    requested_by INT NOT NULL,
+    mode VARCHAR(20) DEFAULT 'random',
+    `replace` BOOLEAN DEFAULT FALSE COMMENT 'Reshuffle instead of first assignment',
+    seed BIGINT NULL COMMENT 'Previewed candidate to reproduce, if any',
+    fingerprint CHAR(64) NULL COMMENT 'Inputs the preview was drawn from',
+    status VARCHAR(20) DEFAULT 'queued' COMMENT 'queued, running, done, failed',
+    progress INT DEFAULT 0 COMMENT '0-100',
+    message VARCHAR(255),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME COMMENT 'Last progress report',
+    finished_at DATETIME,
+    INDEX idx_jobs_event (event_id),
+    FOREIGN KEY (event_id) REFERENCES events(event_id) ON DELETE CASCADE,
+    FOREIGN KEY (requested_by) REFERENCES users(user_id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Background assignment jobs table';
+
+-- =====================================================
+-- Table 9: assignment_sets
+-- Packed assignments for large events; assignments rows then
+-- only exist for pairs whose gift_status is not 'pending'
+-- =====================================================
+CREATE TABLE assignment_sets (
+    event_id INT PRIMARY KEY,
+    base_id INT NOT NULL COMMENT 'Lowest participant_id covered',
+    span INT NOT NULL COMMENT 'Entries per slot',
+    slots INT NOT NULL DEFAULT 1,
+    pair_count INT NOT NULL DEFAULT 0,
+    receivers LONGBLOB NOT NULL COMMENT 'int32 receiver per (slot, giver), 0 = none',
+    givers LONGBLOB NOT NULL COMMENT 'int32 giver per (slot, receiver), 0 = none',
+    scores LONGBLOB NOT NULL COMMENT 'uint16 compatibility per (slot, giver)',
+    assigned_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (event_id) REFERENCES events(event_id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Packed assignments table';
+
+-- =====================================================
+-- Table 10: email_outbox
+-- Outgoing email, written in the same transaction as the
+-- change it reports and drained by mail workers
+-- =====================================================
+CREATE TABLE email_outbox (
+    outbox_id INT AUTO_INCREMENT PRIMARY KEY,
+    kind VARCHAR(20) NOT NULL DEFAULT 'email' COMMENT 'email, event_status (fan-out)',
+    recipient VARCHAR(120),
+    subject VARCHAR(255) NOT NULL,
+    html MEDIUMTEXT,
+    payload TEXT COMMENT 'JSON arguments of a fan-out row',
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' COMMENT 'pending, sending, sent, dead',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    claimed_by VARCHAR(32) COMMENT 'Claim token of the worker sending it',
+    claimed_at DATETIME,
+    last_error VARCHAR(255),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    sent_at DATETIME,
+    INDEX idx_outbox_due (status, next_attempt_at),
+    INDEX idx_outbox_claim (claimed_by)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Email outbox table';
+
+-- =====================================================
+-- Table 11: reminder_logs
+-- Deadline reminders already sent, one row per giver and window
+-- =====================================================
+CREATE TABLE reminder_logs (
+    reminder_id INT AUTO_INCREMENT PRIMARY KEY,
+    event_id INT NOT NULL,
+    participant_id INT NOT NULL,
+    window_hours INT NOT NULL COMMENT 'Reminder window it was sent for',
+    sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY unique_reminder (event_id, participant_id, window_hours),
+    FOREIGN KEY (event_id) REFERENCES events(event_id) ON DELETE CASCADE,
+    FOREIGN KEY (participant_id) REFERENCES participants(participant_id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Deadline reminder log table';
+
+-- =====================================================
+-- Table 12: invite_code_blocks
+-- Invite code sequence blocks reserved by app processes
+-- =====================================================
+CREATE TABLE invite_code_blocks (
+    block_id INT AUTO_INCREMENT PRIMARY KEY COMMENT 'Covers block_id * 1000 onwards',
+    reserved_at DATETIME DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Invite code sequence blocks table';
+
 -- =====================================================
 -- Sample Data (Optional - for testing)
 -- =====================================================
@@ -9,6 +9,15 @@ config_name = os.environ.get('FLASK_ENV', 'development')
 
 app = create_app(config_name)
 
+# Send email left in the outbox by an earlier run (and retries) from startup,
+# not only once this process queues new mail. Gunicorn imports this module
+# as "run" and `python run.py` runs it as "__main__"; worker processes
+# started with spawn (assignment jobs, sharded solves) re-import it as
+# "__mp_main__" and must not start senders of their own.
+if __name__ != '__mp_main__':
+    from app.utils.outbox import outbox_worker
+    outbox_worker.start(app)
+
 if __name__ == '__main__':
     # Render sets PORT env var; fallback to 5000 locally
     port = int(os.environ.get('PORT', 5000))
@@ -1,5 +1,6 @@
-from app import create_app
+from app import create_app, db
 from app.utils.email_service import send_event_created_email
+from app.utils.outbox import drain_outbox
 from app.models import Event, User
 
 
@@ -12,6 +13,8 @@ def main():
 
         if event and user:
             send_event_created_email(event, user)
+            db.session.commit()
+            drain_outbox()
             print("✅ Test email sent! Check your inbox (and spam).")
         else:
             print("❌ No Event/User found in database. Create at least one event and one user, then try again.")